@@ -22,7 +22,9 @@ from education.views import (
     DepartmentViewset,
     EnrollmentViewset,
     ExportStudentsView,
+    ExportTimetablesView,
     ImportCourseCSV,
+    ImportJobView,
     ImportSpecialDayCSV,
     ImportStudentCSV,
     ParcoursViewset,
@@ -30,6 +32,7 @@ from education.views import (
     TranslationView,
     ViewContractPDF,
     ParameterView,
+    PDFJobView,
     ModifyYearInformations,
     SendBulkAccountCreationEmailView
 )
@@ -54,8 +57,11 @@ urlpatterns = [
     path("upload/course", ImportCourseCSV.as_view(), name="upload_course_csv"),
     path("upload/specialday", ImportSpecialDayCSV.as_view(), name="upload_special_day_csv"),
     path("upload/student", ImportStudentCSV.as_view(), name="upload_student_csv"),
+    path("upload/jobs/<str:job_id>", ImportJobView.as_view(), name="import_job"),
     path("contract/<int:id>", ViewContractPDF.as_view(), name="contract_pdf"),
+    path("pdf-jobs/<str:job_id>", PDFJobView.as_view(), name="pdf_job"),
     path("students/export", ExportStudentsView.as_view(), name="export_students"),
+    path("students/timetables", ExportTimetablesView.as_view(), name="export_timetables"),
     path("parameters", ParameterView.as_view(), name="parameters"),
     path("yearinformations", ModifyYearInformations.as_view(), name="modify_year_informations"),
     path('admin/send-bulk-account-creation-emails/', SendBulkAccountCreationEmailView.as_view(), name='send_bulk_account_creation_emails'),
@@ -0,0 +1,186 @@
+"""
+Academic calendar used to draw the annual timetable.
+
+The calendar is read from YearInformation and SpecialDay the first time a
+timetable is rendered and then kept for the whole process. Saving one of these
+models invalidates it (see education.signals); other processes reload it after
+CALENDAR_TTL seconds.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+# Durée (en secondes) pendant laquelle un processus garde le calendrier
+CALENDAR_TTL = 60
+
+DEFAULT_YEAR = 2025
+
+DEFAULT_SEMESTER_BEGIN = {
+    0: datetime.date(DEFAULT_YEAR - 1, 8, 26),
+    1: datetime.date(DEFAULT_YEAR - 1, 9, 16),
+    2: datetime.date(DEFAULT_YEAR - 1, 11, 18),
+    3: datetime.date(DEFAULT_YEAR, 2, 3),
+    4: datetime.date(DEFAULT_YEAR, 4, 14),
+}
+
+ONE_WEEK = datetime.timedelta(weeks=1)
+
+
+class AcademicCalendar:
+    """
+    Dates of the school year and their place in the annual table.
+
+    `semester_begin` maps each half-semester (0 for S3A to 3 for S4B) to its
+    first Monday, 4 being the end of the year. Row i of the annual table is
+    the week starting on `mondays[i - 1]`; `cells` maps every date of these
+    weeks to its (row, weekday) position and `teaching_weeks` lists the rows
+    of each half-semester, holidays excluded.
+    """
+
+    def __init__(self, year_info=None, special_days=()):
+        if year_info is None:
+            self.semester_begin = dict(DEFAULT_SEMESTER_BEGIN)
+            self.vacation = {}
+            self.public_holiday = {}
+        else:
+            self.semester_begin = {
+                0: year_info.start_of_the_school_year,
+                1: year_info.start_of_S3B,
+                2: year_info.start_of_S4A,
+                3: year_info.start_of_S4B,
+                4: year_info.end_of_school_year,
+            }
+            xmas = year_info.monday_of_xmas_holiday
+            self.vacation = {
+                year_info.monday_of_autumn_holiday: "Vacances de Toussaint",
+                xmas: "Vacances de Noël",
+                xmas + ONE_WEEK: "Vacances de Noël",
+                year_info.monday_of_winter_holiday: "Vacances d'Hiver",
+                year_info.monday_of_spring_holiday: "Vacances de Pâques",
+            }
+            self.public_holiday = {
+                "Fête du Travail": self.school_date(1, 5),
+                "Victoire 1945": self.school_date(8, 5),
+                "Armistice 1918": self.school_date(11, 11),
+                "Lundi de Pâques": year_info.easter_monday,
+                "Jeune Ascension": year_info.ascension_day,
+                "Pentecôte": year_info.whit_monday,
+            }
+        self.year = self.semester_begin[4].year
+        self.special_days = {day.name: day.date for day in special_days}
+
+        self.mondays = []
+        monday = self.semester_begin[0]
+        while monday < self.semester_begin[4]:
+            self.mondays.append(monday)
+            monday += ONE_WEEK
+        self.week = {monday: row for row, monday in enumerate(self.mondays, start=1)}
+        self.cells = {
+            monday + datetime.timedelta(days=weekday): (row, weekday)
+            for monday, row in self.week.items()
+            for weekday in range(7)
+        }
+
+        holidays = {self.week.get(monday) for monday in self.vacation}
+        self.teaching_weeks = {}
+        for sem in range(4):
+            first = self.week_row(self.semester_begin[sem])
+            last = self.week_row(self.semester_begin[sem + 1]) if sem < 3 else len(self.mondays) + 1
+            self.teaching_weeks[sem] = [row for row in range(first, last) if row not in holidays]
+
+        self.version = hashlib.sha256(
+            json.dumps(
+                [
+                    [
+                        str(getattr(year_info, field.attname))
+                        for field in year_info._meta.fields
+                    ]
+                    if year_info
+                    else None,
+                    sorted((day.name, str(day.date)) for day in special_days),
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    # Deux calendriers construits à partir des mêmes dates sont interchangeables,
+    # ce qui permet de mettre en cache ce qui en dépend (voir exportpdf)
+    def __eq__(self, other):
+        return isinstance(other, AcademicCalendar) and self.version == other.version
+
+    def __hash__(self):
+        return hash(self.version)
+
+    def week_row(self, date):
+        """
+        Return the row of the week holding a date, the dates out of the year
+        being snapped to its first row or to the row after its last one.
+        """
+        row = (date - self.semester_begin[0]).days // 7 + 1
+        return min(max(row, 1), len(self.mondays) + 1)
+
+    def school_date(self, day, month):
+        """Return the date of a (day, month) that falls during the school year."""
+        start = self.semester_begin[0]
+        year = start.year if month >= start.month else start.year + 1
+        return datetime.date(year, month, day)
+
+    def locate(self, date):
+        """Return the (row, weekday) of a date in the annual table, or None."""
+        return self.cells.get(date)
+
+    def opening_week(self, number):
+        """Return the Monday of the n-th week of the year, or None."""
+        if 1 <= number <= len(self.mondays):
+            return self.mondays[number - 1]
+        return None
+
+
+def load_calendar():
+    """Read the academic calendar from the database."""
+    from .models import SpecialDay, YearInformation
+
+    try:
+        return AcademicCalendar(YearInformation.objects.first(), list(SpecialDay.objects.all()))
+    except DatabaseError as e:
+        logger.warning("Academic calendar unavailable, using default dates: %s", e)
+        return AcademicCalendar()
+
+
+_calendar = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def get_calendar():
+    """Return the academic calendar, loading it on first use."""
+    global _calendar, _loaded_at
+    with _lock:
+        if _calendar is None or time.monotonic() - _loaded_at > CALENDAR_TTL:
+            _calendar = load_calendar()
+            _loaded_at = time.monotonic()
+        return _calendar
+
+
+def use_calendar(calendar):
+    """
+    Use `calendar` for the rest of the process without ever reading the
+    database, e.g. in the worker processes of a bulk render.
+    """
+    global _calendar, _loaded_at
+    with _lock:
+        _calendar = calendar
+        _loaded_at = float("inf")
+
+
+def invalidate_calendar():
+    """Forget the academic calendar so that it is read again on next use."""
+    global _calendar
+    with _lock:
+        _calendar = None
@@ -16,6 +16,7 @@ class StudentAdmin(admin.ModelAdmin):
 
 
 class CourseAdmin(admin.ModelAdmin):
+    exclude = ["conflicts"]
     search_fields = ["name", "code", "department__name"]
     list_filter = ["department", "semester", "day"]
     list_display = ["name", "code", "department"]
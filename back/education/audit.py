@@ -0,0 +1,133 @@
+"""
+Whole-population audit of the students' course choices.
+
+All the enrollments and parcours mandatory courses are loaded in a handful of
+queries and turned into a students x courses matrix, so that overlapping
+courses and missing ECTS are computed for every student at once.
+"""
+import numpy as np
+
+from .models import MIN_ECTS, Course, Enrollment, Parcours, Student
+
+
+def _as_pairs(rows):
+    return np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+
+
+def audit_students(students=None):
+    """
+    Return the students that have overlapping courses or less than MIN_ECTS.
+
+    Each entry holds the student's identity, their ECTS total as computed by
+    Student.count_ects and the codes of their overlapping courses.
+    """
+    if students is None:
+        students = Student.objects.all()
+    rows = list(
+        students.order_by("surname", "name").values(
+            "id",
+            "name",
+            "surname",
+            "department__code",
+            "parcours_id",
+            "parcours__name",
+            "parcours__base_ects",
+            "parcours__academic_base_ects",
+        )
+    )
+    if not rows:
+        return []
+
+    student_ids = np.array([row["id"] for row in rows], dtype=np.int64)
+    student_parcours = np.array([row["parcours_id"] or 0 for row in rows], dtype=np.int64)
+    base_ects = np.array(
+        [
+            (row["parcours__base_ects"] or 0) + (row["parcours__academic_base_ects"] or 0)
+            for row in rows
+        ],
+        dtype=np.float64,
+    )
+
+    enrollments = _as_pairs(
+        Enrollment.objects.filter(student__in=students).values_list("student_id", "course_id")
+    )
+    mandatory = _as_pairs(
+        Parcours.courses_mandatory.through.objects.filter(
+            parcours_id__in=set(student_parcours.tolist())
+        ).values_list("parcours_id", "course_id")
+    )
+    catalog = {
+        course_id: (code, ects)
+        for course_id, code, ects in Course.objects.values_list("id", "code", "ects")
+    }
+
+    # Seuls les cours effectivement choisis forment les colonnes de la matrice
+    course_ids = np.unique(np.concatenate([enrollments[:, 1], mandatory[:, 1]]))
+    course_count = len(course_ids)
+
+    # counts[i, k] : nombre de fois où le cours k compte pour l'étudiant i
+    counts = np.zeros((len(rows), course_count), dtype=np.float32)
+    order = np.argsort(student_ids)
+    np.add.at(
+        counts,
+        (
+            order[np.searchsorted(student_ids, enrollments[:, 0], sorter=order)],
+            np.searchsorted(course_ids, enrollments[:, 1]),
+        ),
+        1,
+    )
+    parcours_ids = np.unique(mandatory[:, 0])
+    parcours_courses = np.zeros((len(parcours_ids), course_count), dtype=np.float32)
+    np.add.at(
+        parcours_courses,
+        (
+            np.searchsorted(parcours_ids, mandatory[:, 0]),
+            np.searchsorted(course_ids, mandatory[:, 1]),
+        ),
+        1,
+    )
+    has_parcours = np.isin(student_parcours, parcours_ids)
+    counts[has_parcours] += parcours_courses[
+        np.searchsorted(parcours_ids, student_parcours[has_parcours])
+    ]
+
+    ects = base_ects + counts @ np.array(
+        [catalog[course_id][1] for course_id in course_ids.tolist()], dtype=np.float64
+    )
+
+    edges = _as_pairs(
+        Course.conflicts.through.objects.filter(
+            from_course_id__in=course_ids.tolist(), to_course_id__in=course_ids.tolist()
+        ).values_list("from_course_id", "to_course_id")
+    )
+    conflicts = np.zeros((course_count, course_count), dtype=np.float32)
+    conflicts[
+        np.searchsorted(course_ids, edges[:, 0]), np.searchsorted(course_ids, edges[:, 1])
+    ] = 1
+    occupied = (counts > 0).astype(np.float32)
+    overlap_counts = ((occupied @ conflicts) * occupied).sum(axis=1)
+
+    report = []
+    for i in np.flatnonzero((overlap_counts > 0) | (ects < MIN_ECTS)).tolist():
+        row = rows[i]
+        overlaps = []
+        if overlap_counts[i]:
+            taken = np.flatnonzero(occupied[i])
+            first, second = np.nonzero(np.triu(conflicts[np.ix_(taken, taken)]))
+            overlaps = [
+                [catalog[int(course_ids[taken[a]])][0], catalog[int(course_ids[taken[b]])][0]]
+                for a, b in zip(first.tolist(), second.tolist())
+            ]
+        report.append(
+            {
+                "id": row["id"],
+                "name": row["name"],
+                "surname": row["surname"],
+                "department": row["department__code"],
+                "parcours": row["parcours__name"],
+                "ects": round(float(ects[i]), 2),
+                "missing_ects": max(0.0, round(MIN_ECTS - float(ects[i]), 2)),
+                "overlaps": overlaps,
+            }
+        )
+    return report
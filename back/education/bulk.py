@@ -0,0 +1,129 @@
+"""
+Bulk rendering of the timetables of a whole department.
+
+The students are read from the database by the calling process, a chunk at a
+time, and their timetables are keyed as they come: students with identical
+schedules share one PDF. The calling process also looks up the timetable
+cache; only the missing distinct PDFs are rendered, by a pool of worker
+processes that never touch the database: they receive the course dicts and
+the academic calendar and call generate_pdf_from_courses. The PDFs are
+written into a ZIP archive as they finish and the archive is streamed chunk
+by chunk, so that at most a few PDFs are held in memory whatever the size of
+the department.
+"""
+import logging
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .academic_calendar import get_calendar, use_calendar
+from .exportpdf import generate_pdf_from_courses
+from .pdfcache import cached_pdf, canonical_courses, store_pdf, timetable_key
+from .schedule import with_schedules
+
+logger = logging.getLogger(__name__)
+
+
+def timetable_filename(student):
+    return f"{student.surname}_{student.name}_{student.id}.pdf".replace("/", "-")
+
+
+def timetable_jobs(students, renderer="table"):
+    """
+    Yield (key, courses, intro, year, filename) for the students that have a
+    department and a parcours, as they are read: students with the same
+    timetable key (see pdfcache.timetable_key) share a single rendered PDF.
+    """
+    students = with_schedules(students.exclude(department=None).exclude(parcours=None))
+    for student in students.order_by("surname", "name").iterator(chunk_size=200):
+        courses = canonical_courses(student.timetable_courses())
+        intro = student.department.timetable_intro
+        key = timetable_key(courses, intro, student.year, renderer)
+        yield key, courses, intro, student.year, timetable_filename(student)
+
+
+def _init_worker(calendar):
+    use_calendar(calendar)
+
+
+def _render(courses, intro, year_student, renderer):
+    return generate_pdf_from_courses("", courses, intro, year_student, renderer)
+
+
+def render_timetables(students, workers=None, renderer="table"):
+    """
+    Yield (filename, pdf) for the timetable of every student of a queryset,
+    in the order in which they are ready.
+    """
+    workers = workers or os.cpu_count() or 1
+    calendar = get_calendar()
+    # Fichiers en attente de chaque rendu en cours, et timetables déjà rendues
+    waiting = {}
+    rendered = set()
+    count = 0
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(calendar,)
+    ) as executor:
+        pending = {}
+        for key, courses, intro, year_student, filename in timetable_jobs(students, renderer):
+            count += 1
+            if key in waiting:
+                waiting[key].append(filename)
+                continue
+            pdf = cached_pdf(key)
+            if pdf is not None:
+                yield filename, pdf
+                continue
+            rendered.add(key)
+            waiting[key] = [filename]
+            future = executor.submit(_render, courses, intro, year_student, renderer)
+            pending[future] = key
+            # On borne le nombre de rendus en attente pour garder une mémoire constante
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from _collect(pending, waiting, future)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from _collect(pending, waiting, future)
+    logger.info("Rendered %d timetables, %d distinct", count, len(rendered))
+
+
+def _collect(pending, waiting, future):
+    key = pending.pop(future)
+    pdf = future.result()
+    # Les étudiants suivants ayant la même timetable la liront dans le cache
+    store_pdf(key, pdf)
+    for filename in waiting.pop(key):
+        yield filename, pdf
+
+
+class ZipStream:
+    """Write-only file object emptied by pop(), used to stream a ZipFile."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def timetables_zip(students, workers=None, renderer="table"):
+    """Yield the chunks of a ZIP archive of the timetables of the students."""
+    stream = ZipStream()
+    # Les PDF sont déjà compressés par ReportLab
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as archive:
+        for filename, pdf in render_timetables(students, workers, renderer):
+            archive.writestr(filename, pdf)
+            yield stream.pop()
+    yield stream.pop()
@@ -0,0 +1,333 @@
+"""
+Timetable PDFs drawn directly on a ReportLab canvas.
+
+generate_pdf_from_courses lays the tables out with platypus, whose per-cell
+style processing and layout pass are most of the cost of a render. The
+tables are already placed by weekly_table and annual_table, so this backend
+paints the same cells and style commands with canvas primitives: the page
+looks the same and is built several times faster.
+
+Only the style commands used by these tables are supported. A timetable
+that doesn't fit on its pages (e.g. after a long intro) is left to platypus,
+which splits it across pages.
+"""
+from io import BytesIO
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from .academic_calendar import get_calendar
+from .exportpdf import annual_layers, annual_table, generate_pdf_table, timetable_sections, weekly_table
+from .profiling import stage
+
+# Marges du cadre de SimpleDocTemplate et des cellules des tables platypus
+FRAME_PADDING = 6
+CELL_PADDING = {"left": 6, "right": 6, "top": 3, "bottom": 3}
+# Interligne des cellules platypus
+LEADING = 12
+
+TEXT_COMMANDS = {"FONTNAME", "FONTSIZE", "ALIGN", "VALIGN", "TEXTCOLOR"}
+LINE_COMMANDS = {"LINEABOVE", "LINEBELOW", "LINEAFTER", "BOX"}
+
+# Style par défaut des cellules platypus
+DEFAULT_STYLE = {
+    "FONTNAME": "Helvetica",
+    "FONTSIZE": 10,
+    "ALIGN": "LEFT",
+    "VALIGN": "BOTTOM",
+    "TEXTCOLOR": "black",
+}
+
+
+class Grid:
+    """
+    A table of fixed column widths, drawn once placed at (x, top) by place.
+
+    Its rows are `row_height` high, or sized from their content as platypus
+    does when `row_height` is None.
+    """
+
+    def __init__(self, table_data, col_widths, row_height, commands):
+        self.data = table_data
+        self.rows = len(table_data)
+        self.cols = len(table_data[0])
+        self.col_widths = col_widths
+        self.commands = [self.normalize(command) for command in commands]
+
+        # Comme platypus, une fusion recouvrant l'origine d'une autre l'annule
+        ranges = {}
+        self.row_spanned = set()
+        for command in self.commands:
+            if command[0] == "SPAN":
+                (sc, sr), (ec, er) = command[1], command[2]
+                for c in range(sc, ec + 1):
+                    for r in range(sr, er + 1):
+                        ranges[(c, r)] = None
+                        if sr != er:
+                            self.row_spanned.add((c, r))
+                ranges[(sc, sr)] = (ec, er)
+        self.covered = set(ranges)
+        self.spans = {cell: last for cell, last in ranges.items() if last is not None}
+
+        if row_height is None:
+            self.row_heights = self.content_heights()
+        else:
+            self.row_heights = [row_height] * self.rows
+        self.height = sum(self.row_heights)
+
+        # Les traits ne traversent pas les cellules fusionnées
+        self.hidden_hlines = set()
+        self.hidden_vlines = set()
+        for (sc, sr), (ec, er) in self.spans.items():
+            for c in range(sc, ec + 1):
+                for r in range(sr, er + 1):
+                    if r > sr:
+                        self.hidden_hlines.add((c, r))
+                    if c > sc:
+                        self.hidden_vlines.add((c, r))
+
+    def content_heights(self):
+        """
+        Return the row heights platypus computes from the cells: each row is
+        as high as its tallest line of text, and the rows under a cell
+        spanning several rows are heightened evenly when it doesn't fit.
+        """
+        padding = CELL_PADDING["top"] + CELL_PADDING["bottom"]
+        heights = []
+        needs = {}
+        for row, values in enumerate(self.data):
+            height = 0
+            for column, value in enumerate(values):
+                cell = (column, row)
+                if cell in self.row_spanned and cell not in self.spans:
+                    continue
+                need = LEADING * len(str(value).split("\n")) + padding
+                last_row = self.spans.get(cell, cell)[1]
+                if last_row != row:
+                    needs[(row, last_row)] = max(needs.get((row, last_row), 0), need)
+                    need = 0
+                height = max(height, need)
+            heights.append(height)
+
+        # Les plus grandes fusions d'abord, comme platypus
+        extra = [0] * self.rows
+        for need, (first, last) in sorted(((need, rows) for rows, need in needs.items()), reverse=True):
+            lines = range(first, last + 1)
+            missing = need - sum(heights[row] + extra[row] for row in lines)
+            if missing > 0:
+                for row in lines:
+                    extra[row] += missing / len(lines)
+        return [height + more for height, more in zip(heights, extra)]
+
+    def place(self, x, top):
+        self.xs = [x]
+        for width in self.col_widths:
+            self.xs.append(self.xs[-1] + width)
+        # ys[i] est le haut de la ligne i
+        self.ys = [top]
+        for height in self.row_heights:
+            self.ys.append(self.ys[-1] - height)
+
+    def normalize(self, command):
+        (sc, sr), (ec, er) = command[1], command[2]
+        return (
+            command[0],
+            (sc % self.cols, sr % self.rows),
+            (ec % self.cols, er % self.rows),
+        ) + tuple(command[3:])
+
+    def backgrounds(self):
+        """
+        Return the (color, first, last) areas to fill, in drawing order.
+
+        Consecutive BACKGROUND commands of single cells are disjoint except
+        when they repeat a cell, the last one winning, so they are merged in
+        runs of the same colour down each column.
+        """
+        areas = []
+        cells = {}
+
+        def flush():
+            for (column, row), color in sorted(cells.items()):
+                last = areas[-1] if areas else None
+                if last and last[0] == color and last[2] == (column, row - 1) and last[1][0] == column:
+                    areas[-1] = (color, last[1], (column, row))
+                else:
+                    areas.append((color, (column, row), (column, row)))
+            cells.clear()
+
+        for op, first, last, *args in self.commands:
+            if op != "BACKGROUND":
+                continue
+            if first == last:
+                cells[first] = args[0]
+            else:
+                flush()
+                areas.append((args[0], first, last))
+        flush()
+        return areas
+
+    def hline(self, canvas, row, first, last):
+        """Draw the edge above `row` from column `first` to `last`, skipping spans."""
+        start = None
+        for column in range(first, last + 2):
+            inside = column > last or (column, row) in self.hidden_hlines
+            if not inside and start is None:
+                start = column
+            elif inside and start is not None:
+                canvas.line(self.xs[start], self.ys[row], self.xs[column], self.ys[row])
+                start = None
+
+    def vline(self, canvas, column, first, last):
+        """Draw the edge before `column` from row `first` to `last`, skipping spans."""
+        start = None
+        for row in range(first, last + 2):
+            inside = row > last or (column, row) in self.hidden_vlines
+            if not inside and start is None:
+                start = row
+            elif inside and start is not None:
+                canvas.line(self.xs[column], self.ys[start], self.xs[column], self.ys[row])
+                start = None
+
+    def draw(self, canvas):
+        canvas.saveState()
+        for color, (sc, sr), (ec, er) in self.backgrounds():
+            canvas.setFillColor(color)
+            canvas.rect(
+                self.xs[sc], self.ys[er + 1], self.xs[ec + 1] - self.xs[sc],
+                self.ys[sr] - self.ys[er + 1], stroke=0, fill=1,
+            )
+
+        canvas.setLineCap(1)
+        canvas.setLineJoin(1)
+        for op, (sc, sr), (ec, er), *args in self.commands:
+            if op not in LINE_COMMANDS:
+                continue
+            canvas.setLineWidth(args[0])
+            canvas.setStrokeColor(args[1])
+            if op == "LINEABOVE":
+                for row in range(sr, er + 1):
+                    self.hline(canvas, row, sc, ec)
+            elif op == "LINEBELOW":
+                for row in range(sr, er + 1):
+                    self.hline(canvas, row + 1, sc, ec)
+            elif op == "LINEAFTER":
+                for column in range(sc, ec + 1):
+                    self.vline(canvas, column + 1, sr, er)
+            else:
+                self.hline(canvas, sr, sc, ec)
+                self.hline(canvas, er + 1, sc, ec)
+                self.vline(canvas, sc, sr, er)
+                self.vline(canvas, ec + 1, sr, er)
+
+        # Tous les textes de la table sont écrits dans un seul objet texte
+        text = canvas.beginText()
+        text_commands = [command for command in self.commands if command[0] in TEXT_COMMANDS]
+        self.font = self.color = None
+        for row, values in enumerate(self.data):
+            for column, value in enumerate(values):
+                if value == "" or (
+                    (column, row) in self.covered and (column, row) not in self.spans
+                ):
+                    continue
+                style = dict(DEFAULT_STYLE)
+                for op, (sc, sr), (ec, er), arg in text_commands:
+                    if sc <= column <= ec and sr <= row <= er:
+                        style[op] = arg
+                self.draw_text(text, column, row, str(value), style)
+        canvas.drawText(text)
+        canvas.restoreState()
+
+    def draw_text(self, text, column, row, value, style):
+        leading = LEADING
+        last_column, last_row = self.spans.get((column, row), (column, row))
+        left, right = self.xs[column], self.xs[last_column + 1]
+        bottom, top = self.ys[last_row + 1], self.ys[row]
+
+        lines = value.split("\n")
+        size = style["FONTSIZE"]
+        if style["VALIGN"] == "MIDDLE":
+            y = bottom + (
+                CELL_PADDING["bottom"] + top - bottom - CELL_PADDING["top"] + len(lines) * leading
+            ) / 2 - size
+        elif style["VALIGN"] == "TOP":
+            y = top - CELL_PADDING["top"] - size
+        else:
+            y = bottom + CELL_PADDING["bottom"] + len(lines) * leading - size
+
+        # Comme platypus, on ne change la police et la couleur que si besoin
+        if self.font != (style["FONTNAME"], size):
+            text.setFont(style["FONTNAME"], size, leading)
+            self.font = (style["FONTNAME"], size)
+        if self.color != style["TEXTCOLOR"]:
+            text.setFillColor(style["TEXTCOLOR"])
+            self.color = style["TEXTCOLOR"]
+        for line in lines:
+            if style["ALIGN"] == "CENTER":
+                x = (left + right + CELL_PADDING["left"] - CELL_PADDING["right"]) / 2
+                x -= stringWidth(line, style["FONTNAME"], size) / 2
+            else:
+                x = left + CELL_PADDING["left"]
+            text.setTextOrigin(x, y)
+            text.textOut(line)
+            y -= leading
+
+
+def draw_grid(canvas, grid, top):
+    """Draw a table centred on the page, its top at `top`."""
+    page_width = canvas._pagesize[0]
+    with stage("layout"):
+        grid.place(FRAME_PADDING + (page_width - 2 * FRAME_PADDING - sum(grid.col_widths)) / 2, top)
+        grid.draw(canvas)
+
+
+def generate_pdf_canvas(courses, intro, year_student="2A", sections=None):
+    """
+    Generate the same timetable as generate_pdf_from_courses with canvas
+    primitives, or with platypus if it doesn't fit on its pages.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.pdfgen.canvas import Canvas
+    from reportlab.platypus import Paragraph
+
+    buffer = BytesIO()
+    canvas = Canvas(buffer, pagesize=A4, invariant=1)
+    top = A4[1] - FRAME_PADDING
+    frame_height = A4[1] - 2 * FRAME_PADDING
+    weekly_widths = [1.5*cm] + [1.8*cm] * 10
+
+    title_text = intro.replace("\n", "<br/>") + "<br/><br/>"
+    title = Paragraph(title_text, getSampleStyleSheet()["Normal"])
+    with stage("layout"):
+        _, height = title.wrapOn(canvas, A4[0] - 2 * FRAME_PADDING, frame_height)
+
+    sections = timetable_sections(year_student, sections)
+    grids = []
+    for section in sections:
+        with stage("style"):
+            if section == "annual":
+                calendar = get_calendar()
+                table_data, commands = annual_table(courses, calendar)
+                grid = Grid(table_data, [27] * len(table_data[0]), 18, annual_layers(calendar)[1] + commands)
+            else:
+                table_data, commands = weekly_table(courses, section)
+                grid = Grid(table_data, weekly_widths, None, commands)
+        grids.append(grid)
+
+    # Chaque section tient sur sa page, la première sous l'intro ; sinon
+    # platypus répartit l'intro et les tables sur plusieurs pages
+    if height + grids[0].height > frame_height or any(grid.height > frame_height for grid in grids):
+        return generate_pdf_table(courses, intro, sections)
+
+    with stage("layout"):
+        title.drawOn(canvas, FRAME_PADDING, top - height)
+    for index, grid in enumerate(grids):
+        if index > 0:
+            canvas.showPage()
+            height = 0
+        draw_grid(canvas, grid, top - height)
+    canvas.showPage()
+    with stage("serialization"):
+        canvas.save()
+    return buffer.getvalue()
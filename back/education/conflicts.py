@@ -0,0 +1,165 @@
+"""
+Timetable conflict detection based on occupancy bitmasks.
+
+Every course is compiled once into an integer where each bit is one minute of
+one (day, half-semester) lane. Two courses overlap if and only if their masks
+share a bit.
+
+The pairwise conflicts of the catalog are persisted in Course.conflicts: the
+whole graph is built in one sweep by rebuild_conflict_graph (see the
+rebuild_conflicts command) and a single course is refreshed by
+update_course_conflicts when it is saved.
+"""
+from collections import defaultdict
+from functools import lru_cache
+
+from django.db import transaction
+
+WEEKDAYS = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"]
+
+# Les semestres entiers (S3, S4...) occupent leurs deux demi-semestres
+HALF_SEMESTERS = ["S3A", "S3B", "S4A", "S4B", "S5A", "S5B", "S6A", "S6B"]
+
+MINUTES_PER_DAY = 24 * 60
+
+
+# Voie de chaque jour rencontré : les jours de la semaine d'abord, puis les
+# autres (semaines d'ouverture, jours inconnus) dans l'ordre d'apparition
+_day_lanes = {day: index for index, day in enumerate(WEEKDAYS)}
+
+
+def day_index(day):
+    """
+    Return the lane index of a course day.
+
+    Days are compared as strings, like Student.check_time_table did: weekdays
+    come first and any other day string (opening week number, unknown day)
+    gets its own lane the first time it is seen, so "1" and "01" differ.
+    """
+    return _day_lanes.setdefault(day, len(_day_lanes))
+
+
+def half_semesters(semester):
+    """Return the indexes of the half-semesters covered by a semester."""
+    return [i for i, half in enumerate(HALF_SEMESTERS) if semester in half]
+
+
+def to_minutes(time):
+    return time.hour * 60 + time.minute
+
+
+def lanes(day, semester):
+    """Return the (day, half-semester) lanes occupied by a course."""
+    index = day_index(day)
+    return [index * len(HALF_SEMESTERS) + half for half in half_semesters(semester)]
+
+
+@lru_cache(maxsize=4096)
+def occupancy_mask(day, start_time, end_time, semester):
+    """
+    Return the occupancy bitmask of a time slot.
+
+    The slot is closed on both ends: two courses where one ends exactly when
+    the other starts are considered incompatible.
+    """
+    start = to_minutes(start_time)
+    end = to_minutes(end_time)
+    if end < start:
+        return 0
+    span = ((1 << (end - start + 1)) - 1) << start
+    mask = 0
+    for lane in lanes(day, semester):
+        mask |= span << (lane * MINUTES_PER_DAY)
+    return mask
+
+
+SCHEDULE_FIELDS = ["id", "day", "start_time", "end_time", "semester"]
+
+
+def find_conflicts(courses):
+    """
+    Return the set of (id, id) pairs of overlapping courses.
+
+    `courses` is an iterable of dicts holding the SCHEDULE_FIELDS. Courses are
+    bucketed by lane and each lane is swept once in start time order.
+    """
+    slots_by_lane = defaultdict(list)
+    for course in courses:
+        start = to_minutes(course["start_time"])
+        end = to_minutes(course["end_time"])
+        if end < start:
+            continue
+        for lane in lanes(course["day"], course["semester"]):
+            slots_by_lane[lane].append((start, end, course["id"]))
+
+    pairs = set()
+    for slots in slots_by_lane.values():
+        slots.sort()
+        active = []
+        for start, end, course_id in slots:
+            active = [slot for slot in active if slot[0] >= start]
+            for _, other_id in active:
+                if other_id != course_id:
+                    pairs.add((min(course_id, other_id), max(course_id, other_id)))
+            active.append((end, course_id))
+    return pairs
+
+
+def rebuild_conflict_graph(course_model=None):
+    """Recompute Course.conflicts for the whole catalog."""
+    if course_model is None:
+        from .models import Course
+
+        course_model = Course
+
+    Conflict = course_model.conflicts.through
+    pairs = find_conflicts(course_model.objects.values(*SCHEDULE_FIELDS))
+    with transaction.atomic():
+        Conflict.objects.all().delete()
+        Conflict.objects.bulk_create(
+            [Conflict(from_course_id=a, to_course_id=b) for a, b in pairs]
+            + [Conflict(from_course_id=b, to_course_id=a) for a, b in pairs],
+            batch_size=1000,
+        )
+    return len(pairs)
+
+
+def add_course_conflicts(course_ids, course_model=None):
+    """
+    Add the conflicts of newly created courses, e.g. after a bulk_create,
+    which doesn't send post_save. Return the number of new pairs.
+    """
+    if course_model is None:
+        from .models import Course
+
+        course_model = Course
+
+    Conflict = course_model.conflicts.through
+    new_ids = set(course_ids)
+    pairs = [
+        (a, b)
+        for a, b in find_conflicts(course_model.objects.values(*SCHEDULE_FIELDS))
+        if a in new_ids or b in new_ids
+    ]
+    Conflict.objects.bulk_create(
+        [Conflict(from_course_id=a, to_course_id=b) for a, b in pairs]
+        + [Conflict(from_course_id=b, to_course_id=a) for a, b in pairs],
+        batch_size=1000,
+    )
+    return len(pairs)
+
+
+def update_course_conflicts(course):
+    """Recompute the conflicts of a single course against the catalog."""
+    # Les horaires sont relus depuis la base : l'instance peut encore
+    # contenir des chaînes "hh:mm" si elle vient d'être créée
+    masks = {
+        other["id"]: occupancy_mask(
+            other["day"], other["start_time"], other["end_time"], other["semester"]
+        )
+        for other in type(course).objects.values(*SCHEDULE_FIELDS)
+    }
+    mask = masks.pop(course.id, 0)
+    course.conflicts.set(
+        [other_id for other_id, other_mask in masks.items() if mask & other_mask]
+    )
@@ -0,0 +1,274 @@
+"""
+Validation of the CSV imports, a whole column at a time.
+
+The rows of a file are turned into one array per column and every check is a
+mask over all the rows, the database being read once per check against it
+(existing codes, departments, users...). Every error of every row is
+reported, so that the file can be fixed in one go; the importers of
+education.utils run the same checks before writing anything, and return
+their report without writing in dry-run mode.
+"""
+import datetime
+
+import numpy as np
+from django.contrib.auth.models import User
+
+from .conflicts import WEEKDAYS
+from .models import Course, Department, SpecialDay, Student
+
+# Valeurs par défaut des cours d'une semaine d'ouverture (jour donné par un numéro)
+OPENING_WEEK_DEFAULTS = {"semester": "S3", "start_time": "8:00", "end_time": "17:00"}
+
+# Colonnes que doit avoir chaque fichier, les autres étant facultatives
+COURSE_COLUMNS = ["code", "name", "department", "ects", "day", "semester", "start_time", "end_time"]
+STUDENT_COLUMNS = ["surname", "name", "email", "department", "year"]
+SPECIAL_DAY_COLUMNS = ["name", "date"]
+
+
+def column(rows, name):
+    """Return the values of a column as an array of strings, "" when missing."""
+    return np.array([row.get(name) or "" for row in rows], dtype=str).reshape(len(rows))
+
+
+def parse_times(values):
+    """
+    Return the minutes since midnight of "HH:MM[:SS]" times and a mask of the
+    valid ones.
+    """
+    parts = np.char.partition(values, ":")
+    hours, separators, rest = parts[:, 0], parts[:, 1], parts[:, 2]
+    parts = np.char.partition(rest, ":")
+    minutes, seconds = parts[:, 0], parts[:, 2]
+    valid = (
+        (separators == ":")
+        & np.char.isdigit(hours)
+        & (np.char.str_len(hours) <= 2)
+        & np.char.isdigit(minutes)
+        & (np.char.str_len(minutes) <= 2)
+        & ((parts[:, 1] == "") | (np.char.isdigit(seconds) & (np.char.str_len(seconds) <= 2)))
+    )
+    hours = np.where(valid, hours, "0").astype(int)
+    minutes = np.where(valid, minutes, "0").astype(int)
+    valid &= (hours < 24) & (minutes < 60)
+    return hours * 60 + minutes, valid
+
+
+def repeated(values):
+    """Return the mask of the values already seen earlier in the array."""
+    mask = np.ones(len(values), dtype=bool)
+    mask[np.unique(values, return_index=True)[1]] = False
+    return mask
+
+
+def missing_columns(rows, names):
+    """
+    Return the errors of the rows of a file missing some of the `names`
+    columns: every row is reported for each missing column.
+    """
+    missing = [name for name in names if name not in rows[0]]
+    return [
+        (index, f"Colonne manquante : '{name}'") for index in range(len(rows)) for name in missing
+    ]
+
+
+def errors_of(checks):
+    """
+    Return the (row, message) errors of a list of (mask, message) checks,
+    row by row and in the order of the checks. `message` is a function of
+    the row index.
+    """
+    errors = []
+    for order, (mask, message) in enumerate(checks):
+        errors += [(index, order, message(index)) for index in np.flatnonzero(mask).tolist()]
+    errors.sort()
+    return [(index, message) for index, _, message in errors]
+
+
+def report(rows, errors, label):
+    """Return the [label, message] list the importers answer with."""
+    return [[label(rows[index]), message] for index, message in errors]
+
+
+def course_errors(rows):
+    """Return the (row, message) errors of the rows of a course CSV."""
+    if not rows:
+        return []
+    missing = missing_columns(rows, COURSE_COLUMNS)
+    if missing:
+        return missing
+    code = column(rows, "code")
+    name = column(rows, "name")
+    department = column(rows, "department")
+    ects = column(rows, "ects")
+    day = column(rows, "day")
+    teacher = column(rows, "teacher")
+
+    opening = np.char.isdigit(day)
+    semester = np.where(opening, OPENING_WEEK_DEFAULTS["semester"], column(rows, "semester"))
+    start, valid_start = parse_times(
+        np.where(opening, OPENING_WEEK_DEFAULTS["start_time"], column(rows, "start_time"))
+    )
+    end, valid_end = parse_times(
+        np.where(opening, OPENING_WEEK_DEFAULTS["end_time"], column(rows, "end_time"))
+    )
+
+    existing = list(Course.objects.filter(code__in=set(code.tolist())).values_list("code", flat=True))
+    departments = list(Department.objects.values_list("code", flat=True))
+
+    return errors_of(
+        [
+            (np.isin(code, existing) | repeated(code), lambda i: "Un cours avec ce code existe déjà"),
+            (code == "", lambda i: "Le code du cours est vide"),
+            (np.char.str_len(code) > 10, lambda i: f"Le code '{code[i]}' dépasse 10 caractères"),
+            (name == "", lambda i: "Le nom du cours est vide"),
+            (np.char.str_len(name) > 200, lambda i: "Le nom du cours dépasse 200 caractères"),
+            (
+                np.char.str_len(teacher) > 100,
+                lambda i: "Le nom de l'enseignant dépasse 100 caractères",
+            ),
+            (
+                ~np.char.isdigit(np.char.replace(ects, ".", "", count=1)),
+                lambda i: f"Le nombre de crédits '{ects[i]}' n'est pas valide. Veuillez utiliser un nombre.",
+            ),
+            (
+                ~np.isin(department, departments),
+                lambda i: f"Le département '{department[i]}' n'existe pas",
+            ),
+            (
+                ~np.isin(semester, Course.Semester.values),
+                lambda i: f"Le semestre '{semester[i]}' n'existe pas. Veuillez utiliser 'S3', 'S3A', 'S3B', 'S4', 'S4A' ou 'S4B'.",
+            ),
+            (np.char.str_len(day) > 10, lambda i: f"Le jour '{day[i]}' dépasse 10 caractères"),
+            (
+                ~np.isin(day, WEEKDAYS) & ~opening,
+                lambda i: f"Le jour '{day[i]}' n'existe pas. Veuillez utiliser 'Lundi', 'Mardi', 'Mercredi', 'Jeudi' ou 'Vendredi'",
+            ),
+            (
+                ~(valid_start & valid_end),
+                lambda i: "L'horaire de début ou de fin n'est pas valide. Veuillez utiliser un format valide (HH:MM)",
+            ),
+            (
+                valid_start & valid_end & (start >= end),
+                lambda i: "L'heure de début doit précéder l'heure de fin",
+            ),
+        ]
+    )
+
+
+def student_username(email):
+    """Return the username of a student: the login of school addresses, the address otherwise."""
+    login, _, domain = email.partition("@")
+    return login if domain == "eleves.enpc.fr" else email
+
+
+def student_errors(rows):
+    """Return the (row, message) errors of the rows of a student CSV."""
+    if not rows:
+        return []
+    missing = missing_columns(rows, STUDENT_COLUMNS)
+    if missing:
+        return missing
+    email = column(rows, "email")
+    name = column(rows, "name")
+    surname = column(rows, "surname")
+    department = column(rows, "department")
+    year = column(rows, "year")
+
+    parts = np.char.partition(email, "@")
+    username = np.where(parts[:, 2] == "eleves.enpc.fr", parts[:, 0], email)
+    valid_email = (parts[:, 0] != "") & (parts[:, 1] == "@") & (parts[:, 2] != "")
+
+    departments = list(Department.objects.values_list("code", flat=True))
+    users = {
+        user[0]: user
+        for user in User.objects.filter(username__in=set(username.tolist())).values_list(
+            "username", "last_name", "first_name", "email", "student"
+        )
+    }
+    known = np.array([value in users for value in username.tolist()], dtype=bool)
+    with_student = np.array(
+        [value in users and users[value][4] is not None for value in username.tolist()], dtype=bool
+    )
+    other_user = np.array(
+        [
+            value in users and users[value][1:4] != (last_name, first_name, address)
+            for value, last_name, first_name, address in zip(
+                username.tolist(), surname.tolist(), name.tolist(), email.tolist()
+            )
+        ],
+        dtype=bool,
+    ) & ~with_student
+
+    return errors_of(
+        [
+            (surname == "", lambda i: "Le nom de l'étudiant est vide"),
+            (np.char.str_len(surname) > 100, lambda i: "Le nom de l'étudiant dépasse 100 caractères"),
+            (name == "", lambda i: "Le prénom de l'étudiant est vide"),
+            (np.char.str_len(name) > 100, lambda i: "Le prénom de l'étudiant dépasse 100 caractères"),
+            (~valid_email, lambda i: f"L'adresse email '{email[i]}' n'est pas valide"),
+            (
+                valid_email & (np.char.str_len(username) > 150),
+                lambda i: f"L'identifiant '{username[i]}' dépasse 150 caractères",
+            ),
+            (
+                ~np.isin(department, departments),
+                lambda i: f"Le département '{department[i]}' n'existe pas",
+            ),
+            (
+                ~np.isin(year, Student.Year.values),
+                lambda i: f"L'année '{year[i]}' n'existe pas. Veuillez utiliser '2A' ou '3A'.",
+            ),
+            (
+                valid_email & (with_student | repeated(username)),
+                lambda i: "Un étudiant avec cet email existe déjà",
+            ),
+            (
+                valid_email & known & other_user,
+                lambda i: f"Un autre utilisateur avec l'identifiant '{username[i]}' existe déjà",
+            ),
+        ]
+    )
+
+
+def special_day_errors(rows, replace=False):
+    """
+    Return the (row, message) errors of the rows of a special day CSV. With
+    `replace`, the existing special days don't count since they are deleted.
+    """
+    if not rows:
+        return []
+    missing = missing_columns(rows, SPECIAL_DAY_COLUMNS)
+    if missing:
+        return missing
+    name = column(rows, "name")
+    raw_dates = column(rows, "date")
+
+    dates = []
+    for value in raw_dates.tolist():
+        try:
+            dates.append(datetime.datetime.strptime(value, "%Y-%m-%d").date().isoformat())
+        except ValueError:
+            dates.append("")
+    dates = np.array(dates, dtype=str).reshape(len(rows))
+    days = np.char.add(np.char.add(name, "|"), dates)
+
+    existing = []
+    if not replace:
+        existing = [
+            f"{day_name}|{date.isoformat()}"
+            for day_name, date in SpecialDay.objects.filter(name__in=set(name.tolist())).values_list(
+                "name", "date"
+            )
+        ]
+
+    return errors_of(
+        [
+            (name == "", lambda i: "Le nom du jour spécial est vide"),
+            (np.char.str_len(name) > 100, lambda i: "Le nom du jour spécial dépasse 100 caractères"),
+            (dates == "", lambda i: "Mauvais format de date. Veuillez utiliser 'AAAA-MM-JJ'."),
+            (
+                (dates != "") & (np.isin(days, existing) | repeated(days)),
+                lambda i: f"Le jour spécial '{name[i]}' le '{dates[i]}' existe déjà.",
+            ),
+        ]
+    )
@@ -1,52 +1,16 @@
 import datetime
 from datetime import time
+from bisect import bisect_right
 from io import BytesIO
-import random as rd
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import landscape, letter
-from reportlab.lib.units import cm
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import (
-    PageBreak,
-    Paragraph,
-    SimpleDocTemplate,
-    Table,
-    TableStyle,
-)
-from django.db.models.signals import post_migrate
-from django.dispatch import receiver
-
-from .models import SpecialDay
-from .models import YearInformation
-
-
-#@receiver(post_migrate)
-def get_year(sender, **kwargs):
-    try:
-        return YearInformation.objects.get().end_of_school_year.year
-    except Exception:
-        return 2025
-
-year = get_year(None)
-
-
-def is_year_bissextile(year):
-    return (year % 4 == 0) and (year % 100 != 0) or (year % 400 == 0)
-
-day_in_month = {
-    1 : 31,
-    2 : 29 if is_year_bissextile(year) else 28,
-    3 : 31,
-    4 : 30,
-    5 : 31,
-    6 : 30,
-    7 : 31,
-    8 : 31,
-    9 : 30,
-    10: 31,
-    11: 30,
-    12: 31
-}
+from textwrap import wrap
+import hashlib
+import logging
+from functools import lru_cache
+
+from .academic_calendar import get_calendar
+from .profiling import stage, timed_render
+
+logger = logging.getLogger(__name__)
 
 
 semester_to_int = {
@@ -66,50 +30,6 @@ semester_to_int = {
 
 
 
-
-hour_to_line = {
-    "8h00": 1,
-    "8h30": 2,
-    "9h00": 3,
-    "9h30": 4,
-    "10h00": 5,
-    "10h30": 6,
-    "11h00": 7,
-    "11h30": 8,
-    "12h00": 9,
-    "12h30": 10,
-    "13h00": 11,
-    "13h30": 12,
-    "14h00": 13,
-    "14h30": 14,
-    "15h00": 15,
-    "15h30": 16,
-    "16h00": 17,
-    "16h30": 18,
-    "17h00": 19,
-    "17h30": 20,
-    "18h00": 21,
-    "18h30": 22,
-    "19h00": 23,
-    "19h30": 24,
-    "20h00": 25,
-}
-
-
-
-background_color = {
-    0 : colors.HexColor("#c9ff96"),
-    1 : colors.HexColor("#7fd3ab"),
-    2 : colors.HexColor("#ffcb67"),
-    3 : colors.HexColor("#67b5ff"),
-    4 : colors.HexColor("#ddff67"),
-    5 : colors.HexColor("#da9870"),
-    6 : colors.HexColor("#da70c0"),
-    7 : colors.HexColor("#70da84"),
-    8 : colors.HexColor("#cffd5d")
-}
-
-
 def center_text(txt):
     #assert(len(txt) <= 14)
     L = len(txt)
@@ -117,167 +37,33 @@ def center_text(txt):
 
 
 
-def add_n_day(day,n):
-    newday = day[0] + n
-    newmonth = day[1]
-    if newday > day_in_month[day[1]]:
-        newday -= day_in_month[day[1]]
-        newmonth = day[1]%12 + 1
-    return newday,newmonth
-
-def add_one_week(day):
-    return add_n_day(day,7)
-
-def is_after(day1, day2):
-    if day1[1] == day2[1]:
-        return day1[0] > day2[0]
-    else:
-        return (day1[1]-8)%12 > (day2[1] - 8)%12
-
-
-def find_day_and_week(day):
-    actual_monday = semester_begin[0]
-    old_monday = actual_monday
-    weeks = 0
-    while is_after(day, actual_monday):
-        weeks += 1
-        old_monday = actual_monday
-        actual_monday = add_one_week(actual_monday)
-    days = 0
-    while is_after(day, old_monday):
-        days += 1
-        old_monday = add_n_day(old_monday,1)
-    return (weeks,days) if days < 7 else (weeks+1,days%7)
-
-
-def write_specil_week(specil_weeks, table_data, style,color):
+# Les fonctions write_* ajoutent à `writes` les cellules (ligne, colonne, texte)
+# du tableau annuel à remplacer et à `commands` leurs commandes de style
+def write_specil_week(specil_weeks, writes, commands, color, calendar):
     for key in specil_weeks:
+        row = calendar.week.get(key)
+        if row is None:
+            logger.debug("The week of %s is not in the school year, can't add it to the timetable", key)
+            continue
         for i in range(20):
-            table_data[week[key]][i+1] = ""
-        table_data[week[key]][len(table_data[0])//2] = specil_weeks[key]
-        style.add("BACKGROUND", (1, week[key]), (-1, week[key]), color,)
+            writes.append((row, i+1, ""))
+        writes.append((row, len(ANNUAL_HEADER)//2, specil_weeks[key]))
+        commands.append(("BACKGROUND", (1, row), (-1, row), color,))
 
-def write_days(spec_days, table_data, style, color):
+def write_days(spec_days, writes, commands, color, calendar):
     for key in spec_days:
-        weeks, days = find_day_and_week(spec_days[key])
+        position = calendar.locate(spec_days[key])
+        if position is None:
+            logger.debug("%s is not in the school year, can't add it to the timetable", key)
+            continue
+        weeks, days = position
         if days >= 5:
-            print(f"The {key} is during week-end, can't add it to the timetable, {days}")
+            logger.debug("%s is during the week-end, can't add it to the timetable", key)
         else:
-            style.add("BACKGROUND", (4*(days) + 1, weeks), (4*(days)+4, weeks), color,)
+            commands.append(("BACKGROUND", (4*(days) + 1, weeks), (4*(days)+4, weeks), color,))
             for i in range(1,5):
-                table_data[weeks][4*days+i] = ""
-            table_data[weeks][4*days+1] = key
-
-#@receiver(post_migrate)
-def on_post_migrate(sender, **kwargs):
-    try:
-        def get_semester_begin():
-            try:
-                year_info = YearInformation.objects.get()
-            except YearInformation.DoesNotExist:
-                # Handle the case where no YearInformation record exists
-                # You might want to create a default record or raise an exception
-                raise ValueError("YearInformation record not found")
-
-            semester_begin = {
-                0: (year_info.start_of_the_school_year.day, year_info.start_of_the_school_year.month),
-                1: (year_info.start_of_S3B.day, year_info.start_of_S3B.month),
-                2: (year_info.start_of_S4A.day, year_info.start_of_S4A.month),
-                3: (year_info.start_of_S4B.day, year_info.start_of_S4B.month),
-                4: (year_info.end_of_school_year.day, year_info.end_of_school_year.month),
-            }
-            return semester_begin
-
-        def get_vacation_dates():
-
-            try:
-                year_info = YearInformation.objects.get()
-            except YearInformation.DoesNotExist:
-                # Handle the case where no YearInformation record exists
-                # You might want to create a default record or raise an exception
-                raise ValueError("YearInformation record not found")
-
-            vacation = {
-                (year_info.monday_of_autumn_holiday.day,
-                year_info.monday_of_autumn_holiday.month): "Vacances de Toussaint",
-                (year_info.monday_of_xmas_holiday.day,
-                year_info.monday_of_xmas_holiday.month): "Vacances de Noël",
-                add_one_week((year_info.monday_of_xmas_holiday.day,
-                year_info.monday_of_xmas_holiday.month)): "Vacances de Noël",
-                (year_info.monday_of_winter_holiday.day,
-                year_info.monday_of_winter_holiday.month): "Vacances d'Hiver",
-                (year_info.monday_of_spring_holiday.day,
-                year_info.monday_of_spring_holiday.month): "Vacances de Pâques",
-            }
-            return vacation
-
-        def get_public_holidays():
-            try:
-                year_info = YearInformation.objects.get()
-                public_holiday = {
-                    "Fête du Travail" : (1, 5),
-                    "Victoire 1945" : (8, 5),
-                    "Armistice 1918" : (11, 11),
-                }
-
-                public_holiday["Lundi de Pâques"] =(year_info.easter_monday.day, year_info.easter_monday.month)
-                public_holiday["Jeune Ascension"] = (year_info.ascension_day.day, year_info.ascension_day.month)
-                public_holiday["Pentecôte"] = (year_info.whit_monday.day, year_info.whit_monday.month)
-                return public_holiday
-            except YearInformation.DoesNotExist:
-                # Handle the case where no YearInformation record exists
-                # You might want to create a default record or raise an exception
-                raise ValueError("YearInformation record not found")
-
-
-        semester_starts = get_semester_begin()
-        vacation_periods = get_vacation_dates()
-        public_holiday = get_public_holidays()
-        return semester_starts,vacation_periods, public_holiday
-    except Exception as e:
-        print("Y'a eu une erreur", e)
-        return {
-    0 : (26,8),
-    1 : (16,9),
-    2 : (18,11),
-    3 : (3,2),
-    4 : (14,4),
-    5 : (16,6)
-    },{},{}
-
-
-
-#@receiver(post_migrate)
-def get_special_days_dict(sender, **kwargs):
-    try:
-        special_days = SpecialDay.objects.all()
-        special_days_dict = {}
-        for day in special_days:
-            special_days_dict[day.name] = (day.date.day, day.date.month)
-        return special_days_dict
-    except Exception:
-        print("Pb during importation of Special days")
-        return {}
-
-
-
-
-
-semester_begin,vacation, public_holiday = on_post_migrate(None)
-
-
-
-
-code_to_hour_line = {}
-
-week = {}
-actual_monday = semester_begin[0]
-i = 1
-while actual_monday != semester_begin[4]:
-    week[actual_monday] = i
-    actual_monday = add_one_week(actual_monday)
-    i+=1
-
+                writes.append((weeks, 4*days+i, ""))
+            writes.append((weeks, 4*days+1, key))
 
 def round_time(time):
     """
@@ -300,16 +86,65 @@ def ceil_time(time):
     return datetime.time(time.hour, minutes)
 
 
-def date_to_hour_id(date: datetime.time):
-    return str(date.hour) + ("h" + str(date.minute)).replace("h0", "h00")
+RENDERERS = ["table", "canvas"]
+
+
+# Pages possibles d'un emploi du temps, dans l'ordre du PDF
+SECTIONS = ["S3", "S4", "S5", "S6", "annual"]
 
 
-def generate_pdf_from_courses(name, courses, intro,year_student="2A"):
+def timetable_sections(year_student, sections=None):
+    """
+    Return the sections to render, in page order: `sections` if given,
+    otherwise every section of the student's year.
+    """
+    if not sections:
+        return ["S3", "S4", "annual"] if year_student == "2A" else ["S5"]
+    return [section for section in SECTIONS if section in sections]
+
+
+def generate_pdf_from_courses(name, courses, intro,year_student="2A", renderer="table", sections=None):
     """
     Generate a pdf from a list of courses.
+
+    `renderer` is "table" to lay the timetable out with platypus tables or
+    "canvas" to draw it directly (see canvaspdf), which is faster.
+    `sections` restricts the PDF to some of the weekly tables and the
+    annual table (see timetable_sections).
     """
+    sections = timetable_sections(year_student, sections)
+    with timed_render(f"{year_student} timetable ({renderer}, {'/'.join(sections)})"):
+        if renderer == "canvas":
+            from .canvaspdf import generate_pdf_canvas
+
+            return generate_pdf_canvas(courses, intro, year_student, sections)
+        return generate_pdf_table(courses, intro, sections)
+
+
+def timed_canvas(*args, **kwargs):
+    """Canvas for doc.build whose serialization of the PDF is timed."""
+    from reportlab.pdfgen.canvas import Canvas
+
+    class TimedCanvas(Canvas):
+        def save(self):
+            with stage("serialization"):
+                super().save()
+
+    return TimedCanvas(*args, **kwargs)
+
+
+def generate_pdf_table(courses, intro, sections):
+    """Lay out the sections of a timetable with platypus."""
+    # ReportLab n'est importé qu'au premier rendu d'un PDF
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate
+
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, rightMargin=0, leftMargin=0, topMargin=0, bottomMargin=0)
+    # Mode invariant : pas de date ni d'identifiant aléatoire dans le PDF, de
+    # sorte que les mêmes cours donnent toujours exactement les mêmes octets
+    doc = SimpleDocTemplate(
+        buffer, rightMargin=0, leftMargin=0, topMargin=0, bottomMargin=0, invariant=1
+    )
     elements = []
 
     title_style = getSampleStyleSheet()["Normal"]
@@ -317,14 +152,15 @@ def generate_pdf_from_courses(name, courses, intro,year_student="2A"):
     title = Paragraph(title_text, title_style)
 
     elements.append(title)
-    print(year_student)
-    generate_table(elements, courses, "S3" if year_student == "2A" else "S5")
-    if year_student == "2A":
-        elements.append(PageBreak())
-        generate_table(elements, courses, "S4")
-        elements.append(PageBreak())
-        generate_annual_table(elements, courses)
-    doc.build(elements)
+    for index, section in enumerate(sections):
+        if index > 0:
+            elements.append(PageBreak())
+        if section == "annual":
+            generate_annual_table(elements, courses)
+        else:
+            generate_table(elements, courses, section)
+    with stage("layout"):
+        doc.build(elements, canvasmaker=timed_canvas)
     pdf = buffer.getvalue()
     buffer.close()
     return pdf
@@ -337,12 +173,6 @@ def generate_pdf_from_courses(name, courses, intro,year_student="2A"):
 
 
 
-# Assurez-vous d'importer les bibliothèques nécessaires
-from reportlab.lib import colors
-from reportlab.platypus import Table, TableStyle
-from reportlab.lib.units import cm
-from datetime import time
-
 # Votre structure de blocs de temps reste inchangée
 TIME_BLOCKS = [
     {"start": time(8, 30), "end": time(11, 30), "rows": 6},
@@ -353,6 +183,12 @@ TIME_BLOCKS = [
     {"start": time(18, 30), "end": time(21, 30), "rows": 4},
 ]
 
+# Première et dernière lignes de chaque bloc dans le tableau hebdomadaire
+BLOCK_LINES = []
+for block in TIME_BLOCKS:
+    start_line = BLOCK_LINES[-1][1] + 1 if BLOCK_LINES else 1
+    BLOCK_LINES.append((start_line, start_line + block["rows"] - 1))
+
 # --- ANCIENNE FONCTION (RENOMMÉE POUR PLUS DE CLARTÉ) ---
 # Utilisée comme solution de repli si l'heure de fin d'un cours est invalide.
 def find_single_course_block(course_start_time, blocks):
@@ -402,129 +238,155 @@ def find_all_course_blocks(course_start_time, course_end_time, blocks):
         
     return matched_blocks
 
-# --- FONCTION PRINCIPALE MISE À JOUR ---
-def generate_table(elements, courses, semester):
-    colors_list = [
-        colors.lightcoral,
-        colors.lightgreen,
-        colors.lightcyan,
-    ]
-    
-    table_data = [
-        [" ", "Lundi", "", "Mardi", "", "Mercredi", "", "Jeudi", "", "Vendredi", ""],
-    ]
+WEEK_HEADER = [" ", "Lundi", "", "Mardi", "", "Mercredi", "", "Jeudi", "", "Vendredi", ""]
 
-    style = TableStyle(
-        [
-            ("FONTNAME", (0, 0), (-1, -1), "Times-Bold"),
-            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-            ("BOX", (0, 0), (-1, -1), 1, colors.black),
-            ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
-            ("BACKGROUND", (0, 1), (0, -1), colors.lightgrey),
-            ("LINEAFTER", (0, 0), (0, -1), 1, colors.black),
-        ]
-    )
+# Colonne de la première moitié (A) de chaque jour
+DAY_COLUMN = {day: WEEK_HEADER.index(day) for day in WEEK_HEADER if day.strip()}
+
+VALID_BLOCK_END_TIMES = {block["end"] for block in TIME_BLOCKS}
+
+BREAK_LABELS = {time(11, 30): "LUNCH", time(15, 15): "BREAK"}
+
+
+@lru_cache(maxsize=None)
+def course_lines(course_start_time, course_end_time):
+    """
+    Return the first and last rows of the weekly table covered by a course,
+    or None if the course is outside the grid.
+    """
+    # Valider si l'heure de fin du cours correspond à une fin de bloc
+    if course_end_time in VALID_BLOCK_END_TIMES:
+        # On cherche tous les blocs que le cours chevauche
+        matched_blocks = find_all_course_blocks(course_start_time, course_end_time, TIME_BLOCKS)
+        if matched_blocks:
+            return matched_blocks[0]["start_line"], matched_blocks[-1]["end_line"]
+        return None
+    # Solution de repli si l'heure de fin est invalide ou manquante
+    block_info = find_single_course_block(course_start_time, TIME_BLOCKS)
+    if block_info:
+        return block_info["start_line"], block_info["end_line"]
+    return None
 
-    # La génération de la grille de base reste identique
-    current_row = 1
-    for block in TIME_BLOCKS:
-        start_line = current_row
-        end_line = start_line + block["rows"] - 1
 
+def place_weekly_courses(courses, semester):
+    """
+    Return the cells of the weekly table of a semester occupied by courses.
+
+    Each cell spans `start_line` to `end_line` and `column` to `last_column`;
+    half-semester courses take one of the two columns of their day.
+    """
+    cells = []
+    for course in courses:
+        if not (course["semester"][:2] == semester):
+            continue
+        lines = course_lines(course["start_time"], course.get("end_time"))
+        if lines is None or course["day"] not in DAY_COLUMN:
+            continue
+
+        column = DAY_COLUMN[course["day"]]
+        if course["semester"].endswith("B"):
+            column += 1
+        is_half = course["semester"].endswith("A") or course["semester"].endswith("B")
+
+        course_text = f'{course["code"]}\n{course["ects"]} ECTS'
+        if len(course.get("semester", "")) == 3:
+            course_text += f"\n({course['semester']})"
+
+        cells.append(
+            {
+                "text": course_text,
+                "code": course["code"],
+                "start_line": lines[0],
+                "end_line": lines[1],
+                "column": column,
+                "last_column": column if is_half else column + 1,
+                "color": course["color"],
+            }
+        )
+    return cells
+
+
+@lru_cache(maxsize=None)
+def weekly_template():
+    """
+    Return the empty weekly table and its style commands.
+
+    They are the same for every timetable, so they are built once per process
+    and copied by generate_table.
+    """
+    from reportlab.lib import colors
+
+    table_data = [list(WEEK_HEADER)]
+    commands = [
+        ("FONTNAME", (0, 0), (-1, -1), "Times-Bold"),
+        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("BOX", (0, 0), (-1, -1), 1, colors.black),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+        ("BACKGROUND", (0, 1), (0, -1), colors.lightgrey),
+        ("LINEAFTER", (0, 0), (0, -1), 1, colors.black),
+    ]
+
+    wed_col = DAY_COLUMN["Mercredi"]
+    for block, (start_line, end_line) in zip(TIME_BLOCKS, BLOCK_LINES):
         for _ in range(block["rows"]):
             table_data.append(["", "", "", "", "", "", "", "", "", "", ""])
 
-        style.add("SPAN", (0, start_line), (0, end_line))
-        style.add("LINEABOVE", (0, start_line), (-1, start_line), 1.5, colors.darkgrey)
-        
-        if block['start'] == time(11, 30):
-            style.add('BACKGROUND', (1, start_line), (-1, end_line), colors.black)
-            style.add('TEXTCOLOR', (1, start_line), (-1, end_line), colors.white)
-            wed_col = table_data[0].index('Mercredi')
-            style.add('SPAN', (wed_col, start_line), (wed_col + 1, end_line))
-            table_data[start_line][wed_col] = "LUNCH"
-        elif block['start'] == time(15, 15):
-            style.add('BACKGROUND', (1, start_line), (-1, end_line), colors.black)
-            style.add('TEXTCOLOR', (1, start_line), (-1, end_line), colors.white)
-            wed_col = table_data[0].index('Mercredi')
-            style.add('SPAN', (wed_col, start_line), (wed_col + 1, end_line))
-            table_data[start_line][wed_col] = "BREAK"
+        commands.append(("SPAN", (0, start_line), (0, end_line)))
+        commands.append(("LINEABOVE", (0, start_line), (-1, start_line), 1.5, colors.darkgrey))
+
+        if block["start"] in BREAK_LABELS:
+            commands.append(("BACKGROUND", (1, start_line), (-1, end_line), colors.black))
+            commands.append(("TEXTCOLOR", (1, start_line), (-1, end_line), colors.white))
+            commands.append(("SPAN", (wed_col, start_line), (wed_col + 1, end_line)))
+            table_data[start_line][wed_col] = BREAK_LABELS[block["start"]]
         else:
             start_str = block["start"].strftime("%Hh%M").replace("h00", "h")
             end_str = block["end"].strftime("%Hh%M").replace("h00", "h")
             table_data[start_line][0] = f"{start_str}\n-\n{end_str}"
-        
-        current_row = end_line + 1
 
     for i in range(1, 6):
-        style.add("LINEAFTER", (2 * i, 0), (2 * i, -1), 1, colors.black)
+        commands.append(("LINEAFTER", (2 * i, 0), (2 * i, -1), 1, colors.black))
 
-    # --- MODIFICATION DE LA LOGIQUE D'AJOUT DES COURS ---
-    valid_block_end_times = {block["end"] for block in TIME_BLOCKS}
+    return table_data, commands
 
-    for course in courses:
-        if not (course["semester"][:2] == semester):
-            continue
-        
-        course_start_time = course["start_time"]
-        course_end_time = course.get("end_time") # Utilise .get() pour éviter une erreur si la clé n'existe pas
 
-        # Valider si l'heure de fin du cours correspond à une fin de bloc
-        is_end_time_valid = course_end_time in valid_block_end_times
-        
-        start_line, end_line = None, None
-        
-        # NOUVELLE LOGIQUE: Gérer les cours sur plusieurs blocs
-        if is_end_time_valid:
-            # On cherche tous les blocs que le cours chevauche
-            matched_blocks = find_all_course_blocks(course_start_time, course_end_time, TIME_BLOCKS)
-            if matched_blocks:
-                # Le SPAN commence à la première ligne du premier bloc trouvé
-                start_line = matched_blocks[0]["start_line"]
-                # et se termine à la dernière ligne du dernier bloc trouvé
-                end_line = matched_blocks[-1]["end_line"]
-        
-        # ANCIENNE LOGIQUE (FALLBACK): si l'heure de fin est invalide ou manquante
-        else:
-            block_info = find_single_course_block(course_start_time, TIME_BLOCKS)
-            if block_info:
-                start_line = block_info["start_line"]
-                end_line = block_info["end_line"]
+def weekly_table(courses, semester):
+    """Return the data and style commands of the weekly table of a semester."""
+    from reportlab.lib import colors
 
-        # Si aucun bloc n'a été trouvé, on passe au cours suivant
-        if start_line is None or course["day"] not in table_data[0]:
-            continue
+    colors_list = [
+        colors.lightcoral,
+        colors.lightgreen,
+        colors.lightcyan,
+    ]
 
-        # Le calcul de la colonne reste le même
-        column = -1
-        if course["semester"].endswith("A"): column = table_data[0].index(course["day"])
-        elif course["semester"].endswith("B"): column = table_data[0].index(course["day"]) + 1
-        else: column = table_data[0].index(course["day"])
+    template_data, template_commands = weekly_template()
+    table_data = [list(row) for row in template_data]
+    commands = list(template_commands)
+
+    with stage("placement"):
+        cells = place_weekly_courses(courses, semester)
+    for cell in cells:
+        first, last = (cell["column"], cell["start_line"]), (cell["last_column"], cell["end_line"])
+        commands.append(("SPAN", first, last))
+        table_data[cell["start_line"]][cell["column"]] = cell["text"]
+        commands.append(("BACKGROUND", first, last, colors_list[cell["color"] % len(colors_list)]))
+        commands.append(("BOX", first, last, 1, colors.black))
+
+    return table_data, commands
 
-        # L'application du style utilise les start_line et end_line calculées
-        if course["semester"].endswith("A") or course["semester"].endswith("B"):
-            style.add("SPAN", (column, start_line), (column, end_line))
-        else:
-            style.add("SPAN", (column, start_line), (column + 1, end_line))
-        
-        course_text = f'{course["code"]}\n{course["ects"]} ECTS'
-        if len(course.get("semester", "")) == 3:
-            course_text += f"\n({course['semester']})"
-        
-        table_data[start_line][column] = course_text
-        
-        background_color = colors_list[course['color'] % len(colors_list)]
-        if course["semester"].endswith("A") or course["semester"].endswith("B"):
-            style.add("BACKGROUND", (column, start_line), (column, end_line), background_color)
-            style.add("BOX", (column, start_line), (column, end_line), 1, colors.black)
-        else:
-            style.add("BACKGROUND", (column, start_line), (column + 1, end_line), background_color)
-            style.add("BOX", (column, start_line), (column + 1, end_line), 1, colors.black)
 
-    col_widths = [1.5*cm] + [1.8*cm] * 10
-    table = Table(table_data, colWidths=col_widths, rowHeights=None)
-    table.setStyle(style)
+def generate_table(elements, courses, semester):
+    from reportlab.lib.units import cm
+    from reportlab.platypus import Table, TableStyle
+
+    with stage("style"):
+        table_data, commands = weekly_table(courses, semester)
+
+        col_widths = [1.5*cm] + [1.8*cm] * 10
+        table = Table(table_data, colWidths=col_widths, rowHeights=None)
+        table.setStyle(TableStyle(commands))
     
     elements.append(table)
 
@@ -541,125 +403,234 @@ def generate_table(elements, courses, semester):
 
 
 
-def add_course(course, table_data, sem, day = None,emplacement = None, dire = None):
-    if not course["code"] in code_to_hour_line:
-        code_to_hour_line[course["code"]] = hour_to_line[date_to_hour_id(round_time(course["start_time"]))]
-    if emplacement == None:
-        if code_to_hour_line[course["code"]] >= 17:
-            add_course(course, table_data, sem, day, 3)
-        else:
-            if code_to_hour_line[course["code"]] >= 11:
-                add_course(course, table_data, sem, day, 2)
-            else:
-                if code_to_hour_line[course["code"]] >= 5:
-                    add_course(course, table_data, sem, day, 1)
-                else:
-                    add_course(course, table_data, sem, day, 0)
-    else:
-        if day == None:
-            day = semester_begin[sem]
-        if emplacement == -1:
-            pass
-        else:
-            if table_data[week[day]][table_data[0].index(course["day"]) + emplacement] == "":
-                table_data[week[day]][table_data[0].index(course["day"]) + emplacement] = course["code"]
-            else:
-                if code_to_hour_line[table_data[week[day]][table_data[0].index(course["day"]) + emplacement]] > code_to_hour_line[course["code"]]:
-                    if table_data[0].index(course["day"]) + emplacement + 1 != 4 and table_data[week[day]][table_data[0].index(course["day"]) + emplacement + 1] == "":
-                        table_data[week[day]][table_data[0].index(course["day"]) + emplacement + 1] = table_data[week[day]][table_data[0].index(course["day"]) + emplacement]
-                        table_data[week[day]][table_data[0].index(course["day"]) + emplacement] = course["code"]
-                    else:
-                        if table_data[0].index(course["day"]) + emplacement - 1 != -1 and table_data[week[day]][table_data[0].index(course["day"]) + emplacement - 1] == "":
-                            table_data[week[day]][table_data[0].index(course["day"]) + emplacement - 1] = course["code"]
-                        else:
-                            pass
+ANNUAL_DAYS = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"]
 
+# Chaque jour du tableau annuel a 4 colonnes : avant 10h, de 10h à 13h,
+# de 13h à 16h et après 16h (heure de début arrondie à la demi-heure)
+ANNUAL_SLOT_STARTS = [time(10, 0), time(13, 0), time(16, 0)]
 
-            day = add_one_week(day)
-            if day != semester_begin[sem+1]:
-                add_course(course, table_data, sem, day,emplacement)
 
+@lru_cache(maxsize=None)
+def annual_slot(start_time):
+    """
+    Return the column (0 to 3) of a course within its day in the annual
+    table, and its start time rounded to the half hour.
+    """
+    start = round_time(start_time)
+    return bisect_right(ANNUAL_SLOT_STARTS, start), start
 
-def generate_annual_table(elements, courses):
-    special_days = get_special_days_dict(None)
-    semester_begin,vacation, public_holiday = on_post_migrate(None)
 
-    actual_monday = semester_begin[0]
+def place_annual_courses(courses, calendar):
+    """
+    Return the {(row, column): code} cells of the annual table occupied by
+    the weekly courses.
 
-    colors_list = [
-        colors.lightcoral,
-        colors.lightgreen,
-        colors.lightcyan,
-    ]
+    When two courses fall in the same cell, the one that starts first keeps
+    it and the other moves to a free neighbouring column of the same day, or
+    isn't shown.
+    """
+    cells = {}
+    for course in courses:
+        if course["day"] not in ANNUAL_DAYS:
+            continue
+        slot, start = annual_slot(course["start_time"])
+        column = 1 + 4 * ANNUAL_DAYS.index(course["day"]) + slot
+        for sem in semester_to_int[course["semester"]]:
+            for row in calendar.teaching_weeks[sem]:
+                occupant = cells.get((row, column))
+                if occupant is None:
+                    cells[(row, column)] = (course["code"], start)
+                elif occupant[1] > start:
+                    if slot < 3 and (row, column + 1) not in cells:
+                        cells[(row, column + 1)] = occupant
+                        cells[(row, column)] = (course["code"], start)
+                    elif slot > 0 and (row, column - 1) not in cells:
+                        cells[(row, column - 1)] = (course["code"], start)
+    return {cell: code for cell, (code, _) in cells.items()}
+
+
+@lru_cache(maxsize=None)
+def course_color(code):
+    """
+    Return the colour of a course in the annual table, derived from its code
+    so that it is the same in every timetable.
+    """
+    from reportlab.lib import colors
 
+    digest = hashlib.sha256(code.encode("utf-8")).digest()
+    return colors.Color(
+        red=0.5 + 0.5 * digest[0] / 255, green=0.5 + 0.5 * digest[1] / 255, blue=digest[2] / 255
+    )
 
-    table_data = [
-        [" ", "Lundi", "" , "" , "" ,"Mardi", "" , "" , "" , "Mercredi", "" , "" , "" , "Jeudi", "" , "" , "" , "Vendredi", "" , "" , ""]
-    ]
 
-    while actual_monday != semester_begin[4]:
-        table_data += [[str(actual_monday[0]) + "/" + str(actual_monday[1])] + 20*[""]]
-        actual_monday = add_one_week(actual_monday)
-
-    style = TableStyle(
-        [
-            ("FONTNAME", (0, 0), (-1, -1), "Times-Bold"),
-            ('FONTSIZE', (1, 1), (-1, -1), 5.5),
-            ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
-            ("BACKGROUND", (0, 0), (0, -1), colors.lightgrey),
-            ("ALIGN", (1, 0), (-1, -1), "LEFT"),
-            ("ALIGN", (0, 1), (0, -1), "CENTER"),
-            ("BOX", (0, 0), (-1, -1), 1, colors.black),
-            ("LINEABOVE", (0, 0), (-1, 0), 1, colors.black),
-            ("LINEABOVE", (0, 0), (0, -1), 1, colors.black),
-            ("LINEBELOW", (0, 0), (-1, -1), 1, colors.black),
-            ("LINEBELOW", (0, 0), (0, -1), 1, colors.black),
-            ("LINEAFTER", (0, 0), (0, -1), 1, colors.black),
-            #("LINEAFTER", (0, 0), (-1, 0), 1, colors.black),
-            ("BACKGROUND", (1, 1), (-1, -1), colors.whitesmoke),
-        ]
-    )
+ANNUAL_HEADER = [" ", "Lundi", "" , "" , "" ,"Mardi", "" , "" , "" , "Mercredi", "" , "" , "" , "Jeudi", "" , "" , "" , "Vendredi", "" , "" , ""]
+
+
+@lru_cache(maxsize=4)
+def annual_layers(calendar):
+    """
+    Return the parts of the annual table that only depend on the calendar.
+
+    They are (table_data, commands, writes, calendar_commands): the empty
+    table and its base style, drawn under the courses, then the special days,
+    public holidays and vacations, drawn over them. They are built once per
+    calendar version and must not be modified.
+    """
+    from reportlab.lib import colors
+
+    table_data = [list(ANNUAL_HEADER)]
+    for monday in calendar.mondays:
+        table_data += [[str(monday.day) + "/" + str(monday.month)] + 20*[""]]
+
+    commands = [
+        ("FONTNAME", (0, 0), (-1, -1), "Times-Bold"),
+        ('FONTSIZE', (1, 1), (-1, -1), 5.5),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+        ("BACKGROUND", (0, 0), (0, -1), colors.lightgrey),
+        ("ALIGN", (1, 0), (-1, -1), "LEFT"),
+        ("ALIGN", (0, 1), (0, -1), "CENTER"),
+        ("BOX", (0, 0), (-1, -1), 1, colors.black),
+        ("LINEABOVE", (0, 0), (-1, 0), 1, colors.black),
+        ("LINEABOVE", (0, 0), (0, -1), 1, colors.black),
+        ("LINEBELOW", (0, 0), (-1, -1), 1, colors.black),
+        ("LINEBELOW", (0, 0), (0, -1), 1, colors.black),
+        ("LINEAFTER", (0, 0), (0, -1), 1, colors.black),
+        #("LINEAFTER", (0, 0), (-1, 0), 1, colors.black),
+        ("BACKGROUND", (1, 1), (-1, -1), colors.whitesmoke),
+    ]
 
     for i in range(1,5):
-        style.add("LINEAFTER", (4*i, 0), (4*i, -1), 1, colors.black,)
+        commands.append(("LINEAFTER", (4*i, 0), (4*i, -1), 1, colors.black,))
+
+    writes = []
+    calendar_commands = []
+    write_days(calendar.special_days, writes, calendar_commands, colors.Color(red=1, blue =0.25, green = 0.25), calendar)
+    write_days(calendar.public_holiday, writes, calendar_commands, colors.Color(red=0.5, blue =0.5, green = 0.5), calendar)
+    write_specil_week(calendar.vacation, writes, calendar_commands, colors.lightgrey, calendar)
+
+    return table_data, commands, writes, calendar_commands
+
+
+def annual_table(courses, calendar):
+    """
+    Return the data of the annual table of a list of courses and the style
+    commands drawn over the base style of annual_layers.
+    """
+    from reportlab.lib import colors
+
+    base_data, _, calendar_writes, calendar_commands = annual_layers(calendar)
+    table_data = [list(row) for row in base_data]
+    commands = []
+
+    with stage("placement"):
+        cells = place_annual_courses(courses, calendar)
+    for (row, column), code in cells.items():
+        table_data[row][column] = code
 
     ouverture_week = {}
 
     for course in courses:
-        if course["day"] in table_data[0]:
-            for sem in semester_to_int[course["semester"]]:
-                add_course(course, table_data, sem)
-        else:
-            monday = semester_begin[0]
-            for i in range(int(course["day"]) - 1):
-                monday = add_one_week(monday)
-            ouverture_week[monday] = course["name"]
-
-    course_color = {}
+        if course["day"].isdigit():
+            monday = calendar.opening_week(int(course["day"]))
+            if monday is not None:
+                ouverture_week[monday] = course["name"]
 
     for i in range(1, len(table_data)):
         for j in range(1, len(table_data[0])):
             if table_data[i][j] != "":
-                if not table_data[i][j] in course_color:
-                    course_color[table_data[i][j]] = colors.Color(red=0.5 + 0.5*rd.random(), green=0.5 + 0.5*rd.random(), blue=rd.random())
-                style.add("BACKGROUND", (j, i), (j, i), course_color[table_data[i][j]],)
-
-
+                commands.append(("BACKGROUND", (j, i), (j, i), course_color(table_data[i][j]),))
 
-    write_days(special_days, table_data, style, colors.Color(red=1, blue =0.25, green = 0.25))
-    write_days(public_holiday, table_data, style, colors.Color(red=0.5, blue =0.5, green = 0.5))
-
-    write_specil_week(vacation, table_data, style, colors.lightgrey)
-    write_specil_week(ouverture_week, table_data, style,colors.Color(blue = 1, green = 0.85, red = 0.25))
+    # Jours fériés, jours spéciaux et vacances, communs à tous les étudiants
+    writes = list(calendar_writes)
+    commands += calendar_commands
+    write_specil_week(ouverture_week, writes, commands, colors.Color(blue = 1, green = 0.85, red = 0.25), calendar)
+    for row, column, text in writes:
+        table_data[row][column] = text
 
+    return table_data, commands
 
 
+def generate_annual_table(elements, courses):
+    from reportlab.platypus import Table, TableStyle
 
+    calendar = get_calendar()
+    with stage("style"):
+        table_data, commands = annual_table(courses, calendar)
 
+        table = Table(table_data, colWidths=27, rowHeights=18)
+        table.setStyle(TableStyle(annual_layers(calendar)[1] + commands))
 
-    table = Table(table_data, colWidths=27, rowHeights=18)
+    elements.append(table)
 
 
-    table.setStyle(style)
+def generate_contract_pdf(student):
+    """Generate the training contract of a student."""
+    from reportlab.lib.units import cm
+    from reportlab.pdfgen import canvas
 
-    elements.append(table)
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer)
+    textobject = p.beginText(2 * cm, 29.7 * cm - 2 * cm)
+    textobject.textLine(
+        "Contrat de formation de " + student.name + " " + student.surname
+    )
+    textobject.textLine(" ")
+    textobject.textLine("Département: " + student.department.code)
+    textobject.textLine("Parcours: " + student.parcours.name)
+    textobject.textLine("Nombres d'ECTS: " + str(student.count_ects()))
+    textobject.textLine(" ")
+    if student.parcours is not None:
+        textobject.textLine("Liste des cours:")
+        textobject.textLine(" ")
+        textobject.textLine("Obligatoire parcours:")
+        for course in student.parcours.courses_mandatory.all():
+            wraped_text = "\n".join(
+                wrap(
+                    course.name
+                    + " - "
+                    + course.semester
+                    + " - "
+                    + str(course.ects)
+                    + " ECTS",
+                    80,
+                )
+            )
+            textobject.textLines(wraped_text)
+
+        textobject.textLine(" ")
+        textobject.textLine("Obligatoire sur liste:")
+        for enrollment in student.mandatory_courses():
+            wraped_text = "\n".join(
+                wrap(
+                    enrollment.course.name
+                    + " - "
+                    + enrollment.course.semester
+                    + " - "
+                    + str(enrollment.course.ects)
+                    + " ECTS",
+                    80,
+                )
+            )
+            textobject.textLine(wraped_text)
+        textobject.textLine(" ")
+        textobject.textLine("Cours électifs: ")
+        for enrollment in student.elective_courses():
+            wraped_text = "\n".join(
+                wrap(
+                    enrollment.course.name
+                    + " - "
+                    + enrollment.course.semester
+                    + " - "
+                    + str(enrollment.course.ects)
+                    + " ECTS",
+                    80,
+                )
+            )
+            textobject.textLines(wraped_text)
+    else:
+        textobject.textLine("Pas de parcours sélectionné par l'étudiant")
+    textobject.textLine(" ")
+    p.drawText(textobject)
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
@@ -0,0 +1,60 @@
+"""
+Placed timetable grid, as JSON, for client-side rendering.
+
+The cells are the ones generate_table and generate_annual_table draw in the
+PDF, so the browser only has to lay them out.
+"""
+from .academic_calendar import get_calendar
+from .exportpdf import (
+    BLOCK_LINES,
+    BREAK_LABELS,
+    TIME_BLOCKS,
+    WEEK_HEADER,
+    annual_table,
+    place_weekly_courses,
+)
+
+
+def weekly_blocks():
+    """Return the time blocks of the weekly table and their rows."""
+    return [
+        {
+            "start": block["start"].strftime("%H:%M"),
+            "end": block["end"].strftime("%H:%M"),
+            "start_line": start_line,
+            "end_line": end_line,
+            "label": BREAK_LABELS.get(block["start"]),
+        }
+        for block, (start_line, end_line) in zip(TIME_BLOCKS, BLOCK_LINES)
+    ]
+
+
+def timetable_grid(courses, year_student="2A"):
+    """
+    Return the grid of a timetable.
+
+    `weekly` maps each semester to its course cells: a cell spans
+    `start_line` to `end_line` and `column` to `last_column` of the weekly
+    table, whose columns are the A and B halves of `days`. `annual` holds
+    the rows of the annual table, the header being row 0, and the [first
+    column, first row, last column, last row, colour] of its coloured areas,
+    -1 meaning the last column.
+    """
+    semesters = ["S3", "S4"] if year_student == "2A" else ["S5"]
+    grid = {
+        "days": [day for day in WEEK_HEADER if day.strip()],
+        "blocks": weekly_blocks(),
+        "weekly": {
+            semester: place_weekly_courses(courses, semester) for semester in semesters
+        },
+    }
+    if year_student == "2A":
+        table_data, commands = annual_table(courses, get_calendar())
+        grid["annual"] = {
+            "rows": table_data,
+            "backgrounds": [
+                [first[0], first[1], last[0], last[1], "#" + color.hexval()[2:]]
+                for _, first, last, color in commands
+            ],
+        }
+    return grid
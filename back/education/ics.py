@@ -0,0 +1,134 @@
+"""
+iCalendar export of a student's timetable.
+
+Every weekly course is expanded over the teaching weeks of its half-semesters
+(see AcademicCalendar.teaching_weeks), without the public holidays and special
+days; opening-week courses take every weekday of their week. The events are
+generated line by line so that the file can be streamed.
+"""
+import datetime
+import hashlib
+import json
+from collections import Counter
+
+from .conflicts import WEEKDAYS
+from .exportpdf import semester_to_int
+
+TIMEZONE = "Europe/Paris"
+
+# Heures d'été et d'hiver de Paris, pour les clients qui ne connaissent pas
+# les fuseaux horaires par leur nom
+VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    "TZID:Europe/Paris",
+    "BEGIN:DAYLIGHT",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "BEGIN:STANDARD",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]
+
+
+def escape(text):
+    return (
+        str(text)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def fold(line):
+    """Split a content line in lines of at most 75 octets (RFC 5545, 3.1)."""
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line + "\r\n"
+    parts = []
+    while len(data) > 75:
+        cut = 75 if not parts else 74
+        # On ne coupe pas au milieu d'un caractère UTF-8
+        while data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(data[:cut].decode("utf-8"))
+        data = data[cut:]
+    parts.append(data.decode("utf-8"))
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def course_dates(course, calendar):
+    """Return the dates on which a course takes place."""
+    skipped = set(calendar.public_holiday.values()) | set(calendar.special_days.values())
+    if course["day"].isdigit():
+        monday = calendar.opening_week(int(course["day"]))
+        if monday is None:
+            return []
+        dates = [monday + datetime.timedelta(days=weekday) for weekday in range(len(WEEKDAYS))]
+    elif course["day"] in WEEKDAYS:
+        weekday = WEEKDAYS.index(course["day"])
+        dates = [
+            calendar.mondays[row - 1] + datetime.timedelta(days=weekday)
+            for sem in semester_to_int.get(course["semester"], [])
+            for row in calendar.teaching_weeks[sem]
+        ]
+    else:
+        return []
+    return sorted(date for date in dates if date not in skipped)
+
+
+def timetable_etag(courses, calendar):
+    """Return a validator of the calendar of a list of courses."""
+    payload = json.dumps(
+        [
+            sorted(
+                [course["code"], course["day"], course["semester"], course["name"],
+                 str(course["start_time"]), str(course["end_time"])]
+                for course in courses
+            ),
+            calendar.version,
+        ]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def timetable_ics(courses, calendar):
+    """Yield the lines of the iCalendar file of a list of courses."""
+    stamp = calendar.semester_begin[0].strftime("%Y%m%dT000000Z")
+    yield "BEGIN:VCALENDAR\r\n"
+    yield "VERSION:2.0\r\n"
+    yield "PRODID:-//My2A//Emploi du temps//FR\r\n"
+    yield "CALSCALE:GREGORIAN\r\n"
+    yield fold("X-WR-CALNAME:Emploi du temps")
+    yield fold("X-WR-TIMEZONE:" + TIMEZONE)
+    for line in VTIMEZONE:
+        yield line + "\r\n"
+    # Un même cours peut figurer deux fois dans l'emploi du temps : les UID
+    # doivent rester uniques, les suivants sont donc numérotés
+    uids = Counter()
+    for course in courses:
+        start = course["start_time"].strftime("%H%M%S")
+        end = course["end_time"].strftime("%H%M%S")
+        for date in course_dates(course, calendar):
+            day = date.strftime("%Y%m%d")
+            uid = f"{escape(course['code'])}-{day}T{start}"
+            uids[uid] += 1
+            if uids[uid] > 1:
+                uid += f"-{uids[uid]}"
+            yield "BEGIN:VEVENT\r\n"
+            yield fold(f"UID:{uid}@my2a")
+            yield f"DTSTAMP:{stamp}\r\n"
+            yield f"DTSTART;TZID={TIMEZONE}:{day}T{start}\r\n"
+            yield f"DTEND;TZID={TIMEZONE}:{day}T{end}\r\n"
+            yield fold(f"SUMMARY:{escape(course['code'])} - {escape(course['name'])}")
+            yield "END:VEVENT\r\n"
+    yield "END:VCALENDAR\r\n"
@@ -0,0 +1,111 @@
+"""
+CSV imports run in the background.
+
+The uploaded file is stored in the "imports" cache and imported by the
+import_csv Celery task (see education.tasks), which records there how many
+rows are done and failed; ImportJobView serves this state to the admin UI.
+Only one import of each kind runs at a time: the lock is taken when the job is
+created and released when the task ends.
+"""
+import logging
+import uuid
+
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+
+from .utils import importCourseCSV, importSpecialDayCSV, importStudentCSV
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = "imports"
+
+# Un import interrompu (worker arrêté...) ne bloque pas les suivants au-delà
+LOCK_TIMEOUT = 60 * 60
+
+IMPORTERS = {
+    "course": importCourseCSV,
+    "student": importStudentCSV,
+    "specialday": importSpecialDayCSV,
+}
+
+
+def lock_key(kind):
+    return f"lock:{kind}"
+
+
+def job_key(job_id):
+    return f"job:{job_id}"
+
+
+def file_key(job_id):
+    return f"file:{job_id}"
+
+
+def create_import(kind, data):
+    """
+    Store the content of a CSV file to import and lock its kind of import.
+    Return the id of the job, or None if an import of this kind is running.
+    """
+    cache = caches[CACHE_ALIAS]
+    job_id = uuid.uuid4().hex
+    if not cache.add(lock_key(kind), job_id, LOCK_TIMEOUT):
+        return None
+    cache.set(file_key(job_id), data)
+    cache.set(
+        job_key(job_id),
+        {"job": job_id, "kind": kind, "status": "pending", "rows": None, "done": 0, "failed": 0},
+    )
+    return job_id
+
+
+def import_status(job_id):
+    """Return the state of an import job, or None if it is unknown."""
+    return caches[CACHE_ALIAS].get(job_key(job_id))
+
+
+def update_status(job_id, **changes):
+    cache = caches[CACHE_ALIAS]
+    state = cache.get(job_key(job_id)) or {"job": job_id}
+    state.update(changes)
+    cache.set(job_key(job_id), state)
+
+
+def release_lock(kind, job_id):
+    cache = caches[CACHE_ALIAS]
+    if cache.get(lock_key(kind)) == job_id:
+        cache.delete(lock_key(kind))
+
+
+def run_import(job_id, kind, options):
+    """Import the file of a job, recording its progress, then release the lock."""
+    cache = caches[CACHE_ALIAS]
+    try:
+        data = cache.get(file_key(job_id))
+        if data is None:
+            update_status(job_id, status="failed", error="Le fichier à importer a expiré")
+            return
+
+        def progress(done, failed, rows):
+            update_status(job_id, done=done, failed=failed, rows=rows)
+
+        update_status(job_id, status="running")
+        if kind == "student":
+            # Les workers Celery (prefork) sont des processus démons, qui ne
+            # peuvent pas lancer le pool de hash_passwords
+            options = dict(options, workers=1)
+        failed, created = IMPORTERS[kind](ContentFile(data), progress=progress, **options)
+        rows = (import_status(job_id) or {}).get("rows") or 0
+        update_status(
+            job_id,
+            status="done",
+            rows=rows,
+            done=rows,
+            failed=len(failed),
+            result={"failed": [[label, str(error)] for label, error in failed], "created": created},
+        )
+    except Exception as e:
+        logger.exception("Import %s (%s) failed", job_id, kind)
+        update_status(job_id, status="failed", error=str(e))
+    finally:
+        cache.delete(file_key(job_id))
+        release_lock(kind, job_id)
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from education.audit import audit_students
+from education.models import MIN_ECTS, Student
+
+
+class Command(BaseCommand):
+    help = (
+        "List the students that have overlapping courses or less than "
+        f"{MIN_ECTS} ECTS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--department", help="Code of the department to audit")
+        parser.add_argument(
+            "--validated",
+            action="store_true",
+            help="Only audit the students who have validated their choices",
+        )
+
+    def handle(self, *args, **options):
+        students = Student.objects.all()
+        if options["department"]:
+            students = students.filter(department__code=options["department"])
+        if options["validated"]:
+            students = students.filter(editable=False)
+
+        report = audit_students(students)
+        for entry in report:
+            problems = []
+            if entry["missing_ects"]:
+                problems.append(f"{entry['ects']} ECTS (-{entry['missing_ects']})")
+            for first, second in entry["overlaps"]:
+                problems.append(f"{first} / {second}")
+            self.stdout.write(
+                f"{entry['surname'].upper()} {entry['name']} "
+                f"({entry['department']}, {entry['parcours']}): " + ", ".join(problems)
+            )
+        self.stdout.write(self.style.SUCCESS(f"{len(report)} student(s) to check"))
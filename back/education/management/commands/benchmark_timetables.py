@@ -0,0 +1,173 @@
+import datetime
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from education.academic_calendar import AcademicCalendar, use_calendar
+from education.exportpdf import RENDERERS, WEEK_HEADER, generate_pdf_from_courses
+from education.models import SpecialDay, YearInformation
+from education.profiling import STAGES, timed_render
+
+WEEKDAYS = [day for day in WEEK_HEADER if day.strip()]
+
+# Créneaux réalistes (début, fin) du tableau hebdomadaire
+SLOTS = [
+    (datetime.time(8, 30), datetime.time(11, 30)),
+    (datetime.time(9, 0), datetime.time(11, 30)),
+    (datetime.time(10, 15), datetime.time(11, 30)),
+    (datetime.time(12, 15), datetime.time(15, 15)),
+    (datetime.time(13, 45), datetime.time(15, 15)),
+    (datetime.time(15, 30), datetime.time(18, 30)),
+    (datetime.time(16, 45), datetime.time(18, 30)),
+    (datetime.time(18, 30), datetime.time(21, 30)),
+]
+
+YEARS = {"2A": ["S3", "S4"], "3A": ["S5", "S6"]}
+
+
+def benchmark_calendar():
+    """An academic calendar with holidays and special days, independent of the database."""
+    date = datetime.date
+    year_info = YearInformation(
+        start_of_the_school_year=date(2027, 8, 30),
+        start_of_S3B=date(2027, 9, 27),
+        start_of_S4A=date(2027, 11, 22),
+        start_of_S4B=date(2028, 2, 7),
+        end_of_school_year=date(2028, 6, 12),
+        monday_of_autumn_holiday=date(2027, 10, 25),
+        monday_of_xmas_holiday=date(2027, 12, 20),
+        monday_of_winter_holiday=date(2028, 2, 21),
+        monday_of_spring_holiday=date(2028, 4, 17),
+        easter_monday=date(2028, 4, 17),
+        ascension_day=date(2028, 5, 25),
+        whit_monday=date(2028, 6, 5),
+    )
+    special_days = [
+        SpecialDay(name="Journée sportive", date=date(2027, 10, 7)),
+        SpecialDay(name="Forum entreprises", date=date(2027, 11, 16)),
+        SpecialDay(name="Journée des parcours", date=date(2028, 3, 14)),
+    ]
+    return AcademicCalendar(year_info, special_days)
+
+
+def synthetic_catalog(rng, courses_per_semester, opening_weeks):
+    """
+    Return course dicts like Student.timetable_courses for every semester,
+    two thirds of them on half-semesters, and opening-week courses.
+    """
+    catalog = []
+    for year, semesters in YEARS.items():
+        for semester in semesters:
+            for i in range(courses_per_semester):
+                start, end = rng.choice(SLOTS)
+                catalog.append(
+                    {
+                        "name": f"Cours {semester} {i}",
+                        "code": f"{semester}{i:03d}",
+                        "day": rng.choice(WEEKDAYS),
+                        "start_time": start,
+                        "end_time": end,
+                        "semester": semester + rng.choice(["", "A", "B"]),
+                        "ects": rng.choice([1.5, 2.5, 3, 5]),
+                        "color": 0,
+                    }
+                )
+        for week in range(1, opening_weeks + 1):
+            catalog.append(
+                {
+                    "name": f"Semaine d'ouverture {week} ({year})",
+                    "code": f"OUV{year}{week}",
+                    "day": str(week),
+                    "start_time": datetime.time(8, 30),
+                    "end_time": datetime.time(18, 30),
+                    "semester": YEARS[year][0] + "A",
+                    "ects": 2,
+                    "color": 2,
+                }
+            )
+    return catalog
+
+
+def synthetic_students(rng, catalog, count, courses_per_student):
+    """Return the (courses, intro, year) of `count` students, 2A and 3A alternately."""
+    students = []
+    for i in range(count):
+        year = "2A" if i % 2 == 0 else "3A"
+        prefixes = tuple(YEARS[year])
+        weekly = [c for c in catalog if c["semester"].startswith(prefixes) and not c["day"].isdigit()]
+        opening = [c for c in catalog if c["code"].startswith("OUV" + year)]
+        courses = [
+            dict(course, color=rng.randrange(3))
+            for course in rng.sample(weekly, min(courses_per_student, len(weekly)))
+        ]
+        courses.append(rng.choice(opening))
+        intro = f"Emploi du temps {year}\nDépartement de test, étudiant {i}"
+        students.append((courses, intro, year))
+    return students
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the timetables of synthetic students and report the time spent "
+        "in each stage of the render"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=100, help="Number of students (default: 100)")
+        parser.add_argument(
+            "--courses", type=int, default=60, help="Courses per semester in the catalog (default: 60)"
+        )
+        parser.add_argument(
+            "--per-student", type=int, default=16, help="Courses per student (default: 16)"
+        )
+        parser.add_argument(
+            "--renderer", choices=RENDERERS, action="append", help="Renderer to measure (default: all)"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+        parser.add_argument(
+            "--budget",
+            type=float,
+            help="Fail if the median render of a renderer takes more than this many ms",
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        use_calendar(benchmark_calendar())
+        catalog = synthetic_catalog(rng, options["courses"], opening_weeks=3)
+        students = synthetic_students(rng, catalog, options["students"], options["per_student"])
+        self.stdout.write(f"{len(catalog)} courses, {len(students)} students")
+
+        over_budget = []
+        for renderer in options["renderer"] or RENDERERS:
+            # Premier rendu hors mesure : imports de ReportLab et caches
+            generate_pdf_from_courses("", *students[0], renderer=renderer)
+
+            durations = []
+            with timed_render(f"benchmark ({renderer})") as timer:
+                for courses, intro, year in students:
+                    start = time.perf_counter()
+                    generate_pdf_from_courses("", courses, intro, year, renderer)
+                    durations.append((time.perf_counter() - start) * 1000)
+
+            durations.sort()
+            median = statistics.median(durations)
+            p95 = durations[min(len(durations) - 1, int(0.95 * len(durations)))]
+            self.stdout.write(
+                f"{renderer}: median {median:.1f} ms, p95 {p95:.1f} ms, "
+                f"max {durations[-1]:.1f} ms per timetable"
+            )
+            for name in STAGES:
+                share = timer.stages[name] / timer.total if timer.total else 0
+                self.stdout.write(
+                    f"  {name:<14}{timer.stages[name] * 1000 / len(students):8.2f} ms {share:6.1%}"
+                )
+            self.stdout.write(f"  {'other':<14}{timer.other * 1000 / len(students):8.2f} ms")
+            if options["budget"] is not None and median > options["budget"]:
+                over_budget.append(f"{renderer} ({median:.1f} ms)")
+
+        if over_budget:
+            raise CommandError(
+                f"Median render over {options['budget']} ms: " + ", ".join(over_budget)
+            )
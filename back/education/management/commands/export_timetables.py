@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from education.bulk import timetables_zip
+from education.exportpdf import RENDERERS
+from education.models import Department, Student
+
+
+class Command(BaseCommand):
+    help = "Write the timetables of the students of a department into a ZIP archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument("department", help="Code of the department")
+        parser.add_argument("output", help="Path of the ZIP archive to write")
+        parser.add_argument("--parcours", help="Only export the students of this parcours")
+        parser.add_argument(
+            "--workers", type=int, help="Number of rendering processes (default: one per core)"
+        )
+        parser.add_argument(
+            "--renderer", choices=RENDERERS, default="table", help="PDF backend (default: table)"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            department = Department.objects.get(code=options["department"])
+        except Department.DoesNotExist:
+            raise CommandError(f"Unknown department {options['department']}")
+        students = Student.objects.filter(department=department)
+        if options["parcours"]:
+            students = students.filter(parcours__name=options["parcours"])
+
+        with open(options["output"], "wb") as output:
+            for chunk in timetables_zip(students, options["workers"], options["renderer"]):
+                output.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Timetables written to {options['output']}"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from education.conflicts import rebuild_conflict_graph
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the conflicts between courses, e.g. after loading courses "
+        "with loaddata, which doesn't update them"
+    )
+
+    def handle(self, *args, **options):
+        pairs = rebuild_conflict_graph()
+        self.stdout.write(self.style.SUCCESS(f"{pairs} pair(s) of conflicting courses"))
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+from education.conflicts import rebuild_conflict_graph
+
+
+def build_conflicts(apps, schema_editor):
+    rebuild_conflict_graph(apps.get_model("education", "Course"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0026_student_year_alter_course_semester'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='conflicts',
+            field=models.ManyToManyField(blank=True, to='education.course'),
+        ),
+        migrations.RunPython(build_conflicts, migrations.RunPython.noop),
+    ]
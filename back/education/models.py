@@ -10,6 +10,10 @@ from django.utils import timezone
 
 
 
+# Nombre minimum d'ECTS pour valider le contrat d'études
+MIN_ECTS = 39
+
+
 class Department(models.Model):
     name = models.CharField(max_length=100)
     code = models.CharField(max_length=4)
@@ -53,7 +57,8 @@ class SpecialDay(models.Model):
         return self.name
 
 
-from .exportpdf import generate_pdf_from_courses
+from .pdfcache import timetable_pdf
+from .schedule import StudentSchedule
 
 
 
@@ -101,6 +106,9 @@ class Course(models.Model):
 
     teacher = models.CharField(max_length=100, null=True, blank=True)
 
+    # Cours dont l'horaire chevauche celui-ci, tenu à jour par education.signals
+    conflicts = models.ManyToManyField("self", blank=True)
+
 
 def __str__(self):
     return self.code
@@ -154,76 +162,42 @@ class Student(models.Model):
 
     def mandatory_courses(self):
         """Return the list of mandatory courses for the student."""
-        return Enrollment.objects.filter(student=self, category="mandatory")
+        return Enrollment.objects.filter(student=self, category="mandatory").select_related("course")
 
     def elective_courses(self):
         """Return the list of elective courses for the student."""
-        return Enrollment.objects.filter(student=self, category="elective")
+        return Enrollment.objects.filter(student=self, category="elective").select_related("course")
 
-    def check_time_table(self):
+    def schedule(self):
+        """Return the enrollments and parcours courses of the student, loaded once."""
+        return StudentSchedule(self)
+
+    def check_time_table(self, schedule=None):
         """Return the list of compatible courses for the student."""
-        student_courses = [
-            e.course for e in Enrollment.objects.filter(student=self)
-        ] + [course for course in self.parcours.courses_mandatory.all()]
-        compatible_courses = []
-        incompatible_courses = []
+        schedule = schedule or self.schedule()
+        student_courses = [course.id for course in schedule.courses]
         courses = Course.objects.all()
         if len(student_courses) == 0:
-            compatible_courses = courses
-            return compatible_courses
-        for course in courses:
-            for s_courses in student_courses:
-                min_start = min(s_courses.start_time, course.start_time)
-                max_start = max(s_courses.start_time, course.start_time)
-                min_end = min(s_courses.end_time, course.end_time)
-                # Tri des périodes/semestres
-                tiniest_period = max(s_courses.semester, course.semester)
-                widest_period = min(s_courses.semester, course.semester)
-
-                # Vérification de la compatibilité des cours
-                if (
-                        widest_period in tiniest_period
-                        and s_courses.day == course.day
-                        and min_start <= max_start <= min_end
-                ):
-                    incompatible_courses.append(course)
-                    if course in compatible_courses:
-                        compatible_courses.remove(course)
-                    break
-
-                if (
-                    course not in incompatible_courses
-                    and course not in compatible_courses
-                ):
-                    compatible_courses.append(course)
-        return compatible_courses
-
-    def count_ects(self):
+            return courses
+        return courses.exclude(id__in=student_courses).exclude(
+            conflicts__in=student_courses
+        )
+
+    def count_ects(self, schedule=None):
         """Return the number of ects the student has."""
-        student_courses = Enrollment.objects.filter(student=self)
-        ects = 0
-        for course in student_courses:
-            ects += course.course.ects
-        if self.parcours is not None:
-            for course in self.parcours.courses_mandatory.all():
-                ects += course.ects
-        if self.parcours is not None:
-            ects += self.parcours.academic_base_ects + self.parcours.base_ects
-        return ects
+        return (schedule or self.schedule()).ects()
 
     def check_ects(self):
         """Return True if the student has enough ects, False otherwise."""
-        return self.count_ects() >= 39
+        return self.count_ects() >= MIN_ECTS
 
     def __str__(self):
         return self.name + " " + self.surname
 
-    def generate_timetable(self):
-        """Return the timetable of the student."""
-        if self.department is None or self.parcours is None:
-            return generate_pdf_from_courses(self.name, [], "")
-        intro = self.department.timetable_intro
-        courses = [
+    def timetable_courses(self, schedule=None):
+        """Return the courses drawn on the timetable of the student."""
+        schedule = schedule or self.schedule()
+        return [
             {
                 "name": enrolment.course.name,
                 "code": enrolment.course.code,
@@ -234,7 +208,7 @@ class Student(models.Model):
                 "ects": enrolment.course.ects,
                 "color": 0 if enrolment.category == "mandatory" else 1,
             }
-            for enrolment in Enrollment.objects.filter(student=self)
+            for enrolment in schedule.enrollments
         ] + [
             {
                 "name": course.name,
@@ -246,9 +220,18 @@ class Student(models.Model):
                 "ects": course.ects,
                 "color": 2,
             }
-            for course in self.parcours.courses_mandatory.all()
+            for course in schedule.parcours_courses
         ]
-        return generate_pdf_from_courses(self.name, courses, intro, self.year)
+
+    def timetable_args(self, schedule=None):
+        """Return the (courses, intro, year) the timetable is drawn from."""
+        if self.department is None or self.parcours is None:
+            return [], "", "2A"
+        return self.timetable_courses(schedule), self.department.timetable_intro, self.year
+
+    def generate_timetable(self, schedule=None):
+        """Return the timetable of the student."""
+        return timetable_pdf(*self.timetable_args(schedule))
 
 
 class Enrollment(models.Model):
@@ -0,0 +1,96 @@
+"""
+Content-addressed cache of the generated timetable PDFs.
+
+A timetable only depends on the student's courses, the department intro, the
+student's year and the academic calendar (YearInformation and SpecialDay).
+The PDF is stored under a hash of exactly these inputs, so it is rendered once
+and served from the cache until one of them changes. A PDF restricted to some
+sections (e.g. a single semester) is cached under its own key.
+"""
+import hashlib
+import json
+import logging
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .academic_calendar import get_calendar
+from .exportpdf import generate_pdf_from_courses, timetable_sections
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = "timetables"
+
+# Durée pendant laquelle on sait à qui appartient un rendu confié à Celery
+JOB_OWNER_TIMEOUT = 24 * 3600
+
+
+def canonical_courses(courses):
+    """Return the courses in a stable order, independent of the queries."""
+    return sorted(
+        courses,
+        key=lambda course: (
+            course["code"],
+            course["semester"],
+            course["day"],
+            str(course["start_time"]),
+            str(course["end_time"]),
+            course["color"],
+        ),
+    )
+
+
+def timetable_key(courses, intro, year_student, renderer="table", sections=None):
+    """Return the cache key of a timetable."""
+    payload = json.dumps(
+        [
+            canonical_courses(courses),
+            intro,
+            year_student,
+            get_calendar().version,
+            renderer,
+            timetable_sections(year_student, sections),
+        ],
+        default=str,
+        sort_keys=True,
+    )
+    return "timetable:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cached_pdf(key):
+    """Return the PDF stored under `key`, or None if it isn't cached."""
+    try:
+        return caches[CACHE_ALIAS].get(key)
+    except Exception as e:
+        # Le cache n'est qu'une optimisation : on génère le PDF sans lui
+        logger.warning("Timetable cache unavailable: %s", e)
+        return None
+
+
+def store_pdf(key, pdf, timeout=DEFAULT_TIMEOUT):
+    """Store a rendered PDF under `key`."""
+    try:
+        caches[CACHE_ALIAS].set(key, pdf, timeout)
+    except Exception as e:
+        logger.warning("Timetable cache unavailable: %s", e)
+
+
+def timetable_pdf(courses, intro, year_student="2A", renderer="table", sections=None):
+    """Return the timetable PDF of a list of courses, rendering it if needed."""
+    courses = canonical_courses(courses)
+    key = timetable_key(courses, intro, year_student, renderer, sections)
+    pdf = cached_pdf(key)
+    if pdf is None:
+        pdf = generate_pdf_from_courses("", courses, intro, year_student, renderer, sections)
+        store_pdf(key, pdf)
+    return pdf
+
+
+def store_job_owner(job_id, user_id, timeout=JOB_OWNER_TIMEOUT):
+    """Remember which user started the PDF job `job_id`."""
+    store_pdf("pdf-job:" + job_id, user_id, timeout)
+
+
+def job_owner(job_id):
+    """Return the id of the user who started the PDF job `job_id`, if known."""
+    return cached_pdf("pdf-job:" + job_id)
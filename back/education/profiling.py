@@ -0,0 +1,96 @@
+"""
+Timing of the stages of a PDF render.
+
+generate_pdf_from_courses runs inside timed_render, and the rendering code
+marks its stages with stage(): course placement, construction of the style
+commands, layout and drawing, and serialization of the PDF. Nested stages are
+not counted twice: time spent in an inner stage is only charged to it. The
+timings are logged at DEBUG level on the "education.profiling" logger, with
+the stages in the `timings` attribute of the record.
+
+Outside of timed_render, stage() does nothing.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["placement", "style", "layout", "serialization"]
+
+_timer = ContextVar("render_timer", default=None)
+
+
+class RenderTimer:
+    """Seconds spent in each stage of a render, and in total."""
+
+    def __init__(self):
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.total = 0.0
+        self._stack = []
+        self._mark = None
+
+    def _charge(self, now):
+        # Le temps écoulé depuis le dernier changement revient à l'étape en cours
+        if self._stack:
+            name = self._stack[-1]
+            self.stages[name] = self.stages.get(name, 0.0) + now - self._mark
+        self._mark = now
+
+    @contextmanager
+    def stage(self, name):
+        self._charge(time.perf_counter())
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._charge(time.perf_counter())
+            self._stack.pop()
+
+    @property
+    def other(self):
+        """Time spent outside of any stage."""
+        return max(self.total - sum(self.stages.values()), 0.0)
+
+    def summary(self):
+        parts = [f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.stages.items()]
+        parts.append(f"other {self.other * 1000:.1f} ms")
+        return ", ".join(parts)
+
+
+@contextmanager
+def stage(name):
+    """Charge the time spent in the block to a stage of the current render."""
+    timer = _timer.get()
+    if timer is None:
+        yield
+    else:
+        with timer.stage(name):
+            yield
+
+
+@contextmanager
+def timed_render(description):
+    """
+    Time a render and log its stages. A render started inside another timed
+    block (e.g. by the benchmark) is counted in the outer one and not logged.
+    """
+    if _timer.get() is not None:
+        yield _timer.get()
+        return
+    timer = RenderTimer()
+    token = _timer.set(timer)
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.total = time.perf_counter() - start
+        _timer.reset(token)
+        logger.debug(
+            "Rendered %s in %.1f ms (%s)",
+            description,
+            timer.total * 1000,
+            timer.summary(),
+            extra={"timings": dict(timer.stages, total=timer.total)},
+        )
@@ -0,0 +1,95 @@
+"""
+Courses of a student loaded in a constant number of queries.
+
+StudentSchedule gathers the enrollments (with their course) and the mandatory
+courses of the student's parcours once, so that ECTS counts, timetables and
+confirmation mails don't query the database for every course. with_ects does
+the same total in SQL for whole student lists.
+"""
+from django.db.models import F, FloatField, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def with_schedules(students):
+    """
+    Prefetch everything a StudentSchedule needs on a Student queryset, so that
+    building the schedules of a whole list costs no extra query per student.
+    """
+    from .models import Enrollment
+
+    return students.select_related("department", "parcours").prefetch_related(
+        Prefetch("enrollment_set", queryset=Enrollment.objects.select_related("course")),
+        "parcours__courses_mandatory",
+    )
+
+
+def with_ects(students):
+    """
+    Annotate a Student queryset with `total_ects`, the same total as
+    Student.count_ects, computed by the database so that it can be used to
+    filter and sort whole lists in a single query.
+    """
+    from .models import Enrollment, Parcours
+
+    def ects_sum(queryset, group_by):
+        return Coalesce(
+            Subquery(
+                queryset.values(group_by).annotate(total=Sum("course__ects")).values("total"),
+                output_field=FloatField(),
+            ),
+            Value(0.0),
+        )
+
+    return students.annotate(
+        total_ects=ects_sum(Enrollment.objects.filter(student=OuterRef("pk")), "student")
+        + ects_sum(
+            Parcours.courses_mandatory.through.objects.filter(parcours=OuterRef("parcours")),
+            "parcours",
+        )
+        + Coalesce(F("parcours__base_ects"), Value(0.0))
+        + Coalesce(F("parcours__academic_base_ects"), Value(0.0))
+    )
+
+
+def _is_prefetched(instance, name):
+    return name in getattr(instance, "_prefetched_objects_cache", {})
+
+
+class StudentSchedule:
+    """The enrollments and parcours mandatory courses of a student."""
+
+    def __init__(self, student):
+        self.student = student
+        if _is_prefetched(student, "enrollment_set"):
+            self.enrollments = list(student.enrollment_set.all())
+        else:
+            self.enrollments = list(student.enrollment_set.select_related("course"))
+        self.parcours = student.parcours
+        self.parcours_courses = (
+            list(self.parcours.courses_mandatory.all()) if self.parcours is not None else []
+        )
+
+    def enrollments_of(self, category):
+        return [enrollment for enrollment in self.enrollments if enrollment.category == category]
+
+    @property
+    def mandatory(self):
+        """Enrollments in courses on the parcours list."""
+        return self.enrollments_of("mandatory")
+
+    @property
+    def elective(self):
+        """Enrollments in elective courses."""
+        return self.enrollments_of("elective")
+
+    @property
+    def courses(self):
+        """Every course the student attends, enrolled or mandatory."""
+        return [enrollment.course for enrollment in self.enrollments] + self.parcours_courses
+
+    def ects(self):
+        """Return the total number of ects, including the parcours base ects."""
+        ects = sum(course.ects for course in self.courses)
+        if self.parcours is not None:
+            ects += self.parcours.academic_base_ects + self.parcours.base_ects
+        return ects
@@ -3,6 +3,13 @@ from rest_framework import serializers
 from .models import Course, SpecialDay, Department, Enrollment, Parcours, Student, Parameter
 
 
+def student_ects(student):
+    """Return the ects of a student, annotated by schedule.with_ects if possible."""
+    if hasattr(student, "total_ects"):
+        return student.total_ects
+    return student.count_ects()
+
+
 class StudentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Student
@@ -17,10 +24,15 @@ class StudentSerializer(serializers.ModelSerializer):
             "editable",
             "is_admin",
             "has_logged_in",
+            "ects",
         ]
 
     is_admin = serializers.SerializerMethodField()
     has_logged_in = serializers.SerializerMethodField()
+    ects = serializers.SerializerMethodField()
+
+    def get_ects(self, obj):
+        return student_ects(obj)
 
     def get_is_admin(self, obj):
         return obj.user.is_superuser
@@ -95,7 +107,7 @@ class CompleteStudentSerializer(serializers.ModelSerializer):
     has_logged_in = serializers.SerializerMethodField()
 
     def get_ects(self, obj):
-        return obj.count_ects()
+        return student_ects(obj)
 
     def get_has_logged_in(self, obj):
         return obj.user.last_login is not None
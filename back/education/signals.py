@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .academic_calendar import invalidate_calendar
+from .conflicts import update_course_conflicts
+from .models import Course, SpecialDay, YearInformation
+
+
+@receiver(post_save, sender=Course)
+def on_course_saved(sender, instance, raw=False, **kwargs):
+    """Keep the conflict graph up to date when a course is created or edited."""
+    if raw:
+        return
+    update_course_conflicts(instance)
+
+
+@receiver([post_save, post_delete], sender=YearInformation)
+@receiver([post_save, post_delete], sender=SpecialDay)
+def on_calendar_changed(sender, **kwargs):
+    """Reload the academic calendar on next render when its dates change."""
+    invalidate_calendar()
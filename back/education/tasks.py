@@ -0,0 +1,47 @@
+"""
+Celery tasks rendering PDFs outside of the API workers.
+
+The PDF tasks store their PDF in the timetables cache (see pdfcache) and
+return where to find it: the cache key, the name of the file and the id of the
+only user allowed to download it. PDFJobView serves the PDF once the task is
+done. import_csv runs the CSV imports of education.imports.
+"""
+from celery import shared_task
+
+from .exportpdf import generate_contract_pdf
+from .imports import run_import
+from .models import Student
+from .pdfcache import store_pdf, timetable_key, timetable_pdf
+
+# Durée (en secondes) pendant laquelle un contrat reste téléchargeable
+CONTRACT_TIMEOUT = 60 * 60
+
+
+@shared_task(name="render_timetable_pdf")
+def render_timetable_pdf(student_id, user_id, renderer="table", sections=None):
+    student = Student.objects.select_related("department", "parcours").get(id=student_id)
+    courses, intro, year = student.timetable_args()
+    # timetable_pdf garde le PDF sous sa clé de cache, partagée avec les rendus directs
+    timetable_pdf(courses, intro, year, renderer, sections)
+    return {
+        "key": timetable_key(courses, intro, year, renderer, sections),
+        "filename": "timetable.pdf",
+        "user": user_id,
+    }
+
+
+@shared_task(bind=True, name="render_contract_pdf")
+def render_contract_pdf(self, student_id, user_id):
+    student = Student.objects.select_related("department", "parcours").get(id=student_id)
+    key = "contract:" + self.request.id
+    store_pdf(key, generate_contract_pdf(student), CONTRACT_TIMEOUT)
+    return {
+        "key": key,
+        "filename": "contrat" + student.name + "_" + student.surname + ".pdf",
+        "user": user_id,
+    }
+
+
+@shared_task(name="import_csv")
+def import_csv(job_id, kind, options):
+    run_import(job_id, kind, options)
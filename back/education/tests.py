@@ -1,3 +1,1011 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import re
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from my2a.mail import send_confirmation_mail
+
+from .models import MIN_ECTS, Course, Department, Enrollment, Parcours, SpecialDay, Student, YearInformation
+from .academic_calendar import AcademicCalendar, get_calendar
+from .audit import audit_students
+from . import bulk
+from .bulk import render_timetables, timetable_jobs
+from .conflicts import find_conflicts, occupancy_mask
+from .canvaspdf import Grid
+from .exportpdf import (
+    DAY_COLUMN,
+    annual_layers,
+    annual_table,
+    generate_pdf_from_courses,
+    place_annual_courses,
+    place_weekly_courses,
+    weekly_table,
+    weekly_template,
+)
+from .profiling import STAGES
+from .ics import course_dates, timetable_ics
+from .schedule import with_ects, with_schedules
+from .imports import create_import, import_status, release_lock
+from .tasks import import_csv, render_timetable_pdf
+from .utils import MAX_HASH_WORKERS, hash_passwords, importCourseCSV, importSpecialDayCSV, importStudentCSV
+
+
+def pdf_content(pdf):
+    """Return the decoded content streams of a ReportLab PDF."""
+    streams = re.findall(rb"stream\n(.*?)~>endstream", pdf, re.S)
+    return b"".join(zlib.decompress(base64.a85decode(stream)) for stream in streams)
+
+
+def year_info():
+    """The dates of a school year, not saved."""
+    date = datetime.date
+    return YearInformation(
+        start_of_the_school_year=date(2027, 8, 30),
+        start_of_S3B=date(2027, 9, 27),
+        start_of_S4A=date(2027, 11, 22),
+        start_of_S4B=date(2028, 2, 7),
+        end_of_school_year=date(2028, 6, 12),
+        monday_of_autumn_holiday=date(2027, 10, 25),
+        monday_of_xmas_holiday=date(2027, 12, 20),
+        monday_of_winter_holiday=date(2028, 2, 21),
+        monday_of_spring_holiday=date(2028, 4, 17),
+        easter_monday=date(2028, 4, 17),
+        ascension_day=date(2028, 5, 25),
+        whit_monday=date(2028, 6, 5),
+    )
+
+
+class StudentTestCase(TestCase):
+    """A department, a parcours and a student enrolled in some of its courses."""
+
+    COURSE_COUNT = 10
+
+    def setUp(self):
+        self.department = Department.objects.create(name="Informatique", code="IMI")
+        self.parcours = Parcours.objects.create(
+            name="Vision", department=self.department, base_ects=10, academic_base_ects=5
+        )
+        courses = [
+            Course.objects.create(
+                name=f"Cours {i}",
+                code=f"C{i}",
+                department=self.department,
+                semester="S3" if i % 2 else "S4",
+                day="Lundi",
+                start_time=datetime.time(8 + i % 10, 0),
+                end_time=datetime.time(8 + i % 10, 45),
+                ects=2.5,
+            )
+            for i in range(2 * self.COURSE_COUNT)
+        ]
+        self.parcours.courses_mandatory.set(courses[: self.COURSE_COUNT])
+        user = User.objects.create(username="etudiant", email="etudiant@enpc.fr")
+        student = Student.objects.create(
+            user=user,
+            name="Jean",
+            surname="Dupont",
+            department=self.department,
+            parcours=self.parcours,
+            editable=True,
+        )
+        for i, course in enumerate(courses[self.COURSE_COUNT :]):
+            Enrollment.objects.create(
+                student=student, course=course, category="mandatory" if i % 2 else "elective"
+            )
+        self.student_id = student.id
+
+    def fresh_student(self):
+        return Student.objects.get(id=self.student_id)
+
+
+class StudentQueryBudgetTest(StudentTestCase):
+    """The student's course paths run in a constant number of queries."""
+
+    def test_count_ects(self):
+        student = self.fresh_student()
+        with self.assertNumQueries(3):
+            ects = student.count_ects()
+        self.assertEqual(ects, 2 * self.COURSE_COUNT * 2.5 + 15)
+
+    def test_check_time_table(self):
+        student = self.fresh_student()
+        with self.assertNumQueries(4):
+            courses = list(student.check_time_table())
+        self.assertEqual(courses, [])
+
+    def test_generate_timetable(self):
+        student = self.fresh_student()
+        with mock.patch("education.models.timetable_pdf") as generate:
+            with self.assertNumQueries(4):
+                student.generate_timetable()
+        courses = generate.call_args.args[0]
+        self.assertEqual(len(courses), 2 * self.COURSE_COUNT)
+
+    def test_send_confirmation_mail(self):
+        with mock.patch("my2a.mail.send_templated_mail") as send:
+            with self.assertNumQueries(4):
+                send_confirmation_mail(self.student_id)
+        context = send.call_args.kwargs["context"]
+        self.assertEqual(len(context["onlist_courses"]), self.COURSE_COUNT // 2)
+        self.assertEqual(context["total_count"], 2 * self.COURSE_COUNT * 2.5 + 15)
+
+    def test_prefetched_student_list(self):
+        with self.assertNumQueries(3):
+            students = list(with_schedules(Student.objects.all()))
+            totals = [student.count_ects() for student in students]
+        self.assertEqual(totals, [2 * self.COURSE_COUNT * 2.5 + 15])
+
+    def test_annotated_ects(self):
+        with self.assertNumQueries(1):
+            students = list(with_ects(Student.objects.all()).filter(total_ects__lt=100))
+        self.assertEqual([student.total_ects for student in students], [self.fresh_student().count_ects()])
+
+    def test_ects_under_filter(self):
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        self.assertEqual(len(self.client.get("/api/student/", {"ects_under": "100"}).json()), 1)
+        self.assertEqual(len(self.client.get("/api/student/", {"ects_under": "10"}).json()), 0)
+        self.assertEqual(self.client.get("/api/student/", {"ects_under": "abc"}).status_code, 400)
+
+    def test_export_students(self):
+        Student.objects.filter(id=self.student_id).update(editable=False)
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        response = self.client.get("/api/students/export")
+        with self.assertNumQueries(3):
+            content = b"".join(response.streaming_content).decode("utf-8")
+        self.assertEqual(len(content.splitlines()), 2)
+        self.assertIn("Dupont;IMI;Vision", content)
+
+
+class CheckTimeTableTest(TestCase):
+    """The courses a student can still take are those that overlap none of theirs."""
+
+    def setUp(self):
+        self.department = Department.objects.create(name="Informatique", code="IMI")
+
+    def course(self, code, day, semester, start, end):
+        return Course.objects.create(
+            name=code,
+            code=code,
+            department=self.department,
+            semester=semester,
+            day=day,
+            start_time=datetime.time(*start),
+            end_time=datetime.time(*end),
+            ects=2.5,
+        )
+
+    def test_compatible_courses(self):
+        parcours = Parcours.objects.create(
+            name="Vision", department=self.department, base_ects=10, academic_base_ects=5
+        )
+        parcours.courses_mandatory.set([self.course("MANDATORY", "Mardi", "S4", (14, 0), (16, 0))])
+        student = Student.objects.create(
+            user=User.objects.create(username="etudiant"),
+            name="Jean",
+            surname="Dupont",
+            department=self.department,
+            parcours=parcours,
+            editable=True,
+        )
+        for course in [
+            self.course("HALF", "Lundi", "S3A", (8, 0), (9, 0)),
+            self.course("UNKNOWN", "Samedi", "S4", (10, 0), (11, 0)),
+        ]:
+            Enrollment.objects.create(student=student, course=course, category="elective")
+
+        # Un cours de semestre entier occupe ses deux demi-semestres
+        self.course("WHOLE", "Lundi", "S3", (8, 30), (10, 0))
+        self.course("OTHER_HALF", "Lundi", "S3B", (8, 0), (9, 0))
+        self.course("OTHER_DAY", "Mercredi", "S3A", (8, 0), (9, 0))
+        # Les créneaux sont fermés : finir quand l'autre commence est un conflit
+        self.course("TOUCHING", "Lundi", "S3A", (9, 0), (10, 0))
+        self.course("AFTER", "Lundi", "S3A", (9, 15), (10, 0))
+        self.course("HALF_OF_WHOLE", "Mardi", "S4B", (15, 0), (17, 0))
+        self.course("OTHER_SEMESTER", "Mardi", "S3", (14, 0), (16, 0))
+        # Les jours inconnus sont comparés tels quels
+        self.course("SAME_UNKNOWN", "Samedi", "S4A", (10, 30), (12, 0))
+        self.course("OTHER_UNKNOWN", "Dimanche", "S4", (10, 0), (11, 0))
+
+        codes = {course.code for course in student.check_time_table()}
+        self.assertEqual(codes, {"OTHER_HALF", "OTHER_DAY", "AFTER", "OTHER_SEMESTER", "OTHER_UNKNOWN"})
+
+
+class ConflictGraphTest(TestCase):
+    """Course.conflicts follows the edits of the catalog."""
+
+    def setUp(self):
+        self.department = Department.objects.create(name="Informatique", code="IMI")
+
+    def course(self, code, day, semester, start, end):
+        return Course.objects.create(
+            name=f"Cours {code}",
+            code=code,
+            department=self.department,
+            semester=semester,
+            day=day,
+            start_time=datetime.time(start),
+            end_time=datetime.time(end),
+            ects=2.5,
+        )
+
+    def conflicts(self, course):
+        return set(Course.objects.get(id=course.id).conflicts.values_list("code", flat=True))
+
+    def test_course_edits(self):
+        first = self.course("A", "Lundi", "S3", 8, 10)
+        second = self.course("B", "Lundi", "S3A", 9, 11)
+        self.assertEqual(self.conflicts(first), {"B"})
+        self.assertEqual(self.conflicts(second), {"A"})
+
+        second.day = "Mardi"
+        second.save()
+        self.assertEqual(self.conflicts(first), set())
+        second.day = "Lundi"
+        second.semester = "S3B"
+        second.save()
+        self.assertEqual(self.conflicts(first), {"B"})
+
+        first.delete()
+        self.assertEqual(self.conflicts(second), set())
+
+    def test_rebuild_conflicts(self):
+        first = self.course("A", "Lundi", "S3", 8, 10)
+        self.course("B", "Lundi", "S3A", 9, 11)
+        # Comme après un loaddata, qui n'envoie que des post_save "raw"
+        Course.conflicts.through.objects.all().delete()
+        out = io.StringIO()
+        call_command("rebuild_conflicts", stdout=out)
+        self.assertIn("1 pair(s)", out.getvalue())
+        self.assertEqual(self.conflicts(first), {"B"})
+
+    def test_parcours_conflicts(self):
+        first = self.course("A", "Lundi", "S3", 8, 10)
+        second = self.course("B", "Lundi", "S3A", 9, 11)
+        third = self.course("C", "Lundi", "S3B", 9, 11)
+        other = self.course("D", "Mardi", "S3", 8, 10)
+        parcours = Parcours.objects.create(
+            name="Vision", department=self.department, base_ects=10, academic_base_ects=5
+        )
+        parcours.courses_mandatory.set([first, other])
+        parcours.courses_on_list.set([second, third, other])
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+
+        response = self.client.get("/api/parcours/conflicts/", {"parcours": parcours.id}).json()
+        self.assertEqual(len(response), 1)
+        self.assertEqual((response[0]["id"], response[0]["name"]), (parcours.id, "Vision"))
+        self.assertEqual(response[0]["mandatory"], [])
+        self.assertEqual(response[0]["on_list"], [])
+        self.assertEqual(
+            sorted([a["code"], b["code"]] for a, b in response[0]["mandatory_on_list"]),
+            [["A", "B"], ["A", "C"]],
+        )
+        self.assertEqual(
+            response[0]["mandatory_on_list"][0][0], {"id": first.id, "code": "A", "name": "Cours A"}
+        )
+
+
+class AuditTest(TestCase):
+    """The audit flags the students with overlapping courses or missing ECTS."""
+
+    def setUp(self):
+        self.imi = Department.objects.create(name="Informatique", code="IMI")
+        self.gcc = Department.objects.create(name="Génie civil", code="GCC")
+        self.parcours = Parcours.objects.create(
+            name="Vision", department=self.imi, base_ects=10, academic_base_ects=5
+        )
+        courses = {
+            code: Course.objects.create(
+                name=code,
+                code=code,
+                department=self.imi,
+                semester=semester,
+                day=day,
+                start_time=datetime.time(start),
+                end_time=datetime.time(start + 2),
+                ects=ects,
+            )
+            for code, day, semester, start, ects in [
+                ("A", "Lundi", "S3", 8, 10),
+                ("B", "Lundi", "S3A", 9, 10),
+                ("C", "Mardi", "S3", 8, 15),
+                ("D", "Mercredi", "S3", 8, 5),
+            ]
+        }
+        self.parcours.courses_mandatory.set([courses["A"]])
+        for surname, codes in [("Ok", "C"), ("Chevauchement", "BC"), ("Deficit", "D")]:
+            student = self.student(surname, self.imi, self.parcours)
+            for code in codes:
+                Enrollment.objects.create(student=student, course=courses[code], category="elective")
+        self.student("Isole", self.gcc, None, editable=False)
+
+    def student(self, surname, department, parcours, editable=True):
+        return Student.objects.create(
+            user=User.objects.create(username=surname.lower()),
+            name="Jean",
+            surname=surname,
+            department=department,
+            parcours=parcours,
+            editable=editable,
+        )
+
+    def test_audit_students(self):
+        with self.assertNumQueries(5):
+            report = audit_students()
+        self.assertEqual(
+            [(entry["surname"], entry["ects"], entry["missing_ects"], entry["overlaps"]) for entry in report],
+            [
+                ("Chevauchement", 50, 0, [["A", "B"]]),
+                ("Deficit", 30, MIN_ECTS - 30, []),
+                ("Isole", 0, MIN_ECTS, []),
+            ],
+        )
+        # Les totaux sont ceux de Student.count_ects
+        for entry in report:
+            self.assertEqual(entry["ects"], Student.objects.get(id=entry["id"]).count_ects())
+        self.assertEqual((report[2]["department"], report[2]["parcours"]), ("GCC", None))
+        self.assertEqual(audit_students(Student.objects.filter(surname="Ok")), [])
+
+    def test_audit_view(self):
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        report = self.client.get("/api/student/audit/", {"department": self.imi.id}).json()
+        self.assertEqual([entry["surname"] for entry in report], ["Chevauchement", "Deficit"])
+        self.assertEqual(
+            report[0],
+            {
+                "id": Student.objects.get(surname="Chevauchement").id,
+                "name": "Jean",
+                "surname": "Chevauchement",
+                "department": "IMI",
+                "parcours": "Vision",
+                "ects": 50,
+                "missing_ects": 0,
+                "overlaps": [["A", "B"]],
+            },
+        )
+        report = self.client.get("/api/student/audit/", {"editable": "false"}).json()
+        self.assertEqual([entry["surname"] for entry in report], ["Isole"])
+        self.client.force_login(User.objects.get(username="ok"))
+        self.assertEqual(self.client.get("/api/student/audit/").status_code, 403)
+
+    def test_audit_command(self):
+        out = io.StringIO()
+        call_command("audit_students", "--department", "IMI", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            lines,
+            [
+                "CHEVAUCHEMENT Jean (IMI, Vision): A / B",
+                f"DEFICIT Jean (IMI, Vision): 30.0 ECTS (-{MIN_ECTS - 30.0})",
+                "2 student(s) to check",
+            ],
+        )
+        out = io.StringIO()
+        call_command("audit_students", "--validated", stdout=out)
+        self.assertIn(f"ISOLE Jean (GCC, None): 0.0 ECTS (-{float(MIN_ECTS)})", out.getvalue())
+
+
+class ImportTest(StudentTestCase):
+    """CSV imports of courses, students and special days."""
+
+    def course_csv(self, rows):
+        header = "code;name;department;ects;description;teacher;day;semester;start_time;end_time"
+        return SimpleUploadedFile("courses.csv", "\n".join([header] + rows).encode("utf-8"))
+
+    def test_import_courses(self):
+        rows = [
+            f"N{i};Nouveau {i};IMI;2.5;;;Mardi;S3A;{8 + i % 10}:00;{9 + i % 10}:00"
+            for i in range(50)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            failed, created = importCourseCSV(self.course_csv(rows))
+        self.assertEqual(failed, [])
+        self.assertEqual(len(created), 50)
+        self.assertLess(len(queries), 20)
+        # Les conflits sont calculés malgré bulk_create
+        self.assertTrue(Course.objects.get(code="N0").conflicts.filter(code="N10").exists())
+
+    def test_import_progress(self):
+        rows = [f"N{i};Nouveau {i};IMI;2.5;;;Mardi;S3A;8:00;9:00" for i in range(3)]
+        progress = []
+
+        def record(done, failed, total):
+            progress.append((done, failed, total, Course.objects.filter(code="N0").exists()))
+
+        importCourseCSV(self.course_csv(rows), progress=record)
+        # Les cours ne sont comptés qu'une fois écrits
+        self.assertEqual(progress, [(0, 0, 3, False), (3, 0, 3, True)])
+        progress.clear()
+        importCourseCSV(self.course_csv(["N9;Nouveau;XYZ;2.5;;;Mardi;S3A;8:00;9:00"]), progress=record)
+        self.assertEqual([call[:3] for call in progress], [(1, 1, 1)])
+
+    def test_import_courses_is_all_or_nothing(self):
+        rows = [
+            "N1;Nouveau;IMI;2.5;;;Mardi;S3A;8:00;9:00",
+            "N2;Nouveau;XYZ;2.5;;;Mardi;S3A;8:00;9:00",
+            "N3;Nouveau;IMI;2.5;;;Mardi;S3A;8h;9:00",
+            "N1;Doublon;IMI;2.5;;;Mardi;S3A;8:00;9:00",
+            "C1;Existant;IMI;2.5;;;Mardi;S3A;8:00;9:00",
+        ]
+        failed, created = importCourseCSV(self.course_csv(rows))
+        self.assertEqual([code for code, _ in failed], ["N2", "N3", "N1", "C1"])
+        self.assertEqual(created, [])
+        self.assertFalse(Course.objects.filter(code__startswith="N").exists())
+
+    def test_dry_run_import(self):
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        rows = [
+            "N1;Nouveau;IMI;2.5;;;Mardi;S3A;8:00;9:00",
+            "N2;;XYZ;deux;;;Mardi;S3A;10:00;9:00",
+            "N3;Ouverture;IMI;2;;;1;;;",
+            "N4;Nouveau;IMI;2.5;;;Dimanche;S9;8:00;25:00",
+        ]
+        with mock.patch("education.views.import_csv.delay") as delay:
+            response = self.client.post(
+                "/api/upload/course?dry_run=1&async=1", {"csv_file": self.course_csv(rows)}
+            )
+        delay.assert_not_called()
+        self.assertTrue(response.json()["dry_run"])
+        self.assertEqual(
+            [code for code, _ in response.json()["failed"]], ["N2", "N2", "N2", "N2", "N4", "N4", "N4"]
+        )
+        self.assertFalse(Course.objects.filter(code__startswith="N").exists())
+
+        csv_file = SimpleUploadedFile(
+            "students.csv",
+            "\n".join(
+                [
+                    "surname;name;email;department;year",
+                    "Martin;Paul;paul.martin@eleves.enpc.fr;IMI;2A",
+                    "Petit;Luc;luc.petit@eleves.enpc.fr;IMI;4A",
+                    "Dupont;Jean;etudiant@eleves.enpc.fr;IMI;2A",
+                ]
+            ).encode("utf-8"),
+        )
+        response = self.client.post("/api/upload/student?dry_run=1", {"csv_file": csv_file})
+        self.assertEqual(response.json()["created"], ["MARTIN Paul"])
+        self.assertEqual([label for label, _ in response.json()["failed"]], ["PETIT Luc", "DUPONT Jean"])
+        self.assertFalse(User.objects.filter(username="paul.martin").exists())
+
+        # Colonnes manquantes : chaque ligne est signalée, l'import réel n'échoue pas
+        csv_file = SimpleUploadedFile(
+            "students.csv", "surname;email;department;year\nMartin;paul.martin@eleves.enpc.fr;IMI;2A".encode("utf-8")
+        )
+        response = self.client.post("/api/upload/student?dry_run=1", {"csv_file": csv_file})
+        self.assertEqual(response.json()["failed"], [["MARTIN ", "Colonne manquante : 'name'"]])
+        csv_file.seek(0)
+        self.assertEqual(importStudentCSV(csv_file), ([["MARTIN ", "Colonne manquante : 'name'"]], []))
+        response = self.client.post(
+            "/api/upload/course?dry_run=1",
+            {"csv_file": self.course_csv(["N5;Ouverture;IMI;2;;;12345678901;;;"])},
+        )
+        self.assertEqual(len(response.json()["failed"]), 1)
+
+        csv_file = SimpleUploadedFile(
+            "days.csv", "name;date\nPont;2027-05-07\nPont;2027-05-07\nFérié;07/05/2027".encode("utf-8")
+        )
+        response = self.client.post("/api/upload/specialday?dry_run=1", {"csv_file": csv_file})
+        self.assertEqual(response.json()["created"], ["Pont"])
+        self.assertEqual([name for name, _ in response.json()["failed"]], ["Pont", "Férié"])
+
+        # L'import réel signale les mêmes erreurs
+        csv_file.seek(0)
+        failed, created = importSpecialDayCSV(csv_file)
+        self.assertEqual(created, ["Pont"])
+        self.assertEqual([name for name, _ in failed], ["Pont", "Férié"])
+        self.assertEqual(SpecialDay.objects.filter(name="Pont").count(), 1)
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "imports": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        }
+    )
+    def test_background_import(self):
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        rows = [f"N{i};Nouveau {i};IMI;2.5;;;Mardi;S3A;8:00;9:00" for i in range(250)]
+        progress = []
+
+        def delay(job_id, kind, options):
+            import_csv.apply(args=(job_id, kind, options))
+            progress.append(import_status(job_id))
+
+        with mock.patch("education.views.import_csv.delay", side_effect=delay):
+            response = self.client.post(
+                "/api/upload/course?async=1", {"csv_file": self.course_csv(rows)}
+            )
+        self.assertEqual(response.status_code, 202)
+        state = self.client.get(response["Location"]).json()
+        self.assertEqual(state, progress[0])
+        self.assertEqual((state["status"], state["rows"], state["done"], state["failed"]), ("done", 250, 250, 0))
+        self.assertEqual(len(state["result"]["created"]), 250)
+
+        # Un seul import de cours à la fois
+        job_id = create_import("course", b"")
+        with mock.patch("education.views.import_csv.delay") as delay:
+            response = self.client.post(
+                "/api/upload/course?async=1", {"csv_file": self.course_csv(rows)}
+            )
+        self.assertEqual(response.status_code, 409)
+        delay.assert_not_called()
+        release_lock("course", job_id)
+
+    def test_import_students(self):
+        csv_file = SimpleUploadedFile(
+            "students.csv",
+            "\n".join(
+                [
+                    "surname;name;email;department;year",
+                    "Martin;Paul;paul.martin@eleves.enpc.fr;IMI;2A",
+                    "Durand;Anne;anne.durand@example.org;IMI;3A",
+                    "Martin;Paul;paul.martin@eleves.enpc.fr;IMI;2A",
+                    "Petit;Luc;luc.petit@eleves.enpc.fr;XYZ;2A",
+                    "Dupont;Jean;etudiant@eleves.enpc.fr;IMI;2A",
+                ]
+            ).encode("utf-8"),
+        )
+        with mock.patch("education.utils.hash_passwords", side_effect=lambda passwords, *args: passwords):
+            failed, created = importStudentCSV(csv_file)
+        self.assertEqual(created, ["MARTIN Paul", "DURAND Anne"])
+        self.assertEqual([label for label, _ in failed], ["MARTIN Paul", "PETIT Luc", "DUPONT Jean"])
+        student = Student.objects.get(user__username="paul.martin")
+        self.assertEqual((student.department, student.year, student.editable), (self.department, "2A", True))
+        self.assertEqual(Student.objects.get(user__username="anne.durand@example.org").year, "3A")
+        self.assertFalse(User.objects.filter(username="luc.petit").exists())
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "imports": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        },
+        PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+    )
+    def test_background_student_import(self):
+        rows = [f"Nouveau;Eleve{i};eleve{i}@eleves.enpc.fr;IMI;2A" for i in range(2 * MAX_HASH_WORKERS)]
+        job_id = create_import("student", "\n".join(["surname;name;email;department;year"] + rows).encode())
+        # Comme dans un worker Celery, qui ne peut pas avoir de processus enfants,
+        # sur une machine où hash_passwords utiliserait son pool
+        with mock.patch("education.utils.os.cpu_count", return_value=MAX_HASH_WORKERS), mock.patch(
+            "education.utils.ProcessPoolExecutor",
+            side_effect=AssertionError("daemonic processes are not allowed to have children"),
+        ):
+            import_csv.apply(args=(job_id, "student", {}))
+        state = import_status(job_id)
+        self.assertEqual((state["status"], state["failed"]), ("done", 0))
+        self.assertEqual(len(state["result"]["created"]), 2 * MAX_HASH_WORKERS)
+        self.assertTrue(User.objects.get(username="eleve0").has_usable_password())
+
+    def test_hash_passwords(self):
+        passwords = ["a", "b", "c", "d"]
+        hashes = hash_passwords(passwords, workers=2)
+        self.assertTrue(all(map(check_password, passwords, hashes)))
+
+
+class BulkExportTest(StudentTestCase):
+    """Timetables of a whole department exported as a ZIP archive."""
+
+    def test_export_timetables(self):
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        response = self.client.get(
+            "/api/students/timetables", {"dep": self.department.id, "parcours": self.parcours.id}
+        )
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), [f"Dupont_Jean_{self.student_id}.pdf"])
+        self.assertTrue(archive.read(archive.namelist()[0]).startswith(b"%PDF"))
+
+    def test_identical_timetables_are_rendered_once(self):
+        for i in range(2):
+            Student.objects.create(
+                user=User.objects.create(username=f"autre{i}"),
+                name=f"Autre{i}",
+                surname="Martin",
+                department=self.department,
+                parcours=self.parcours,
+                editable=True,
+            )
+        keys = [job[0] for job in timetable_jobs(Student.objects.all())]
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(len(set(keys)), 2)
+
+        # Les rendus sont faits dans des threads pour pouvoir les compter
+        with override_settings(
+            CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+                "timetables": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            }
+        ), mock.patch("education.bulk.ProcessPoolExecutor", ThreadPoolExecutor), mock.patch(
+            "education.bulk._render", wraps=bulk._render
+        ) as render:
+            pdfs = list(render_timetables(Student.objects.all(), workers=1))
+        self.assertEqual(len(pdfs), 3)
+        self.assertEqual(render.call_count, 2)
+
+
+class TimetableViewTest(StudentTestCase):
+    """The timetable of the current student, as a PDF, an iCalendar file or a grid."""
+
+    def test_timetable_ics(self):
+        self.client.force_login(User.objects.get(username="etudiant"))
+        response = self.client.get("/api/student/current/timetable.ics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/calendar; charset=utf-8")
+        content = b"".join(response.streaming_content).decode("utf-8")
+        self.assertTrue(content.startswith("BEGIN:VCALENDAR"))
+        self.assertIn("SUMMARY:C0 - Cours 0", content)
+        response = self.client.get(
+            "/api/student/current/timetable.ics/", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_timetable_etag(self):
+        self.client.force_login(User.objects.get(username="etudiant"))
+        response = self.client.get("/api/student/current/timetable/")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        with mock.patch("education.views.timetable_pdf") as generate:
+            response = self.client.get(
+                "/api/student/current/timetable/", HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        generate.assert_not_called()
+
+    def test_timetable_grid(self):
+        self.client.force_login(User.objects.get(username="etudiant"))
+        grid = self.client.get("/api/student/current/timetable/grid/").json()
+        self.assertEqual(set(grid["weekly"]), {"S3", "S4"})
+        placed = [cell["code"] for cells in grid["weekly"].values() for cell in cells]
+        self.assertTrue(placed)
+        self.assertTrue(set(placed) <= set(Course.objects.values_list("code", flat=True)))
+        self.assertEqual(grid["annual"]["rows"][0][1], "Lundi")
+
+    def test_canvas_renderer(self):
+        self.client.force_login(User.objects.get(username="etudiant"))
+        table = self.client.get("/api/student/current/timetable/")
+        canvas = self.client.get("/api/student/current/timetable/", {"renderer": "canvas"})
+        self.assertEqual(canvas.status_code, 200)
+        self.assertNotEqual(table["ETag"], canvas["ETag"])
+        self.assertEqual(canvas.content.count(b"/Type /Page\n"), table.content.count(b"/Type /Page\n"))
+        response = self.client.get("/api/student/current/timetable/", {"renderer": "svg"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_canvas_overflow(self):
+        time = datetime.time
+        courses = [
+            # Trois lignes de texte dans les deux lignes du déjeuner
+            {"code": "MIDI", "ects": 2.5, "semester": "S5A", "day": "Mardi",
+             "start_time": time(11, 30), "end_time": time(12, 0), "color": 0},
+            {"code": "MATIN", "ects": 5, "semester": "S5A", "day": "Lundi",
+             "start_time": time(8, 30), "end_time": time(11, 30), "color": 1},
+        ]
+        table_data, commands = weekly_table(courses, "S5")
+        self.assertGreater(Grid(table_data, [50] * 11, None, commands).height, 18 * len(table_data))
+
+        for intro in ["Intro", "\n".join(f"Ligne {i}" for i in range(80))]:
+            pdfs = [
+                generate_pdf_from_courses("", courses, intro, "3A", renderer)
+                for renderer in ["table", "canvas"]
+            ]
+            pages = [pdf.count(b"/Type /Page\n") for pdf in pdfs]
+            texts = [sorted(re.findall(rb"\((.*?)\) Tj", pdf_content(pdf))) for pdf in pdfs]
+            self.assertEqual(pages[1], pages[0])
+            self.assertEqual(texts[1], texts[0])
+            self.assertIn(b"MIDI", texts[1])
+        # L'intro de 80 lignes repousse la table sur une deuxième page
+        self.assertEqual(pages[1], 2)
+
+    def test_timetable_sections(self):
+        self.client.force_login(User.objects.get(username="etudiant"))
+        url = "/api/student/current/timetable/"
+        full = self.client.get(url)
+        semester = self.client.get(url, {"section": "S4"})
+        self.assertEqual(semester.status_code, 200)
+        self.assertEqual(semester.content.count(b"/Type /Page\n"), 1)
+        self.assertNotEqual(semester["ETag"], full["ETag"])
+        both = self.client.get(url + "?section=annual&section=S3")
+        self.assertEqual(both.content.count(b"/Type /Page\n"), 2)
+        self.assertEqual(self.client.get(url, {"section": "S3,annual"})["ETag"], both["ETag"])
+        self.assertEqual(self.client.get(url, {"section": "S7"}).status_code, 400)
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "timetables": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        }
+    )
+    def test_async_timetable(self):
+        self.client.force_login(User.objects.get(username="etudiant"))
+        url = "/api/student/current/timetable/"
+        jobs = []
+
+        def delay(*args):
+            jobs.append(render_timetable_pdf.apply(args=args))
+            return jobs[-1]
+
+        with mock.patch("education.views.render_timetable_pdf.delay", side_effect=delay):
+            response = self.client.get(url, {"async": 1, "section": "S3"})
+        self.assertEqual(response.status_code, 202)
+        job_url = response.json()["url"]
+        self.assertEqual(response["Location"], job_url)
+
+        with mock.patch("education.views.AsyncResult", return_value=jobs[0]):
+            response = self.client.get(job_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.content.startswith(b"%PDF"))
+            self.client.force_login(User.objects.create(username="autre"))
+            self.assertEqual(self.client.get(job_url).status_code, 403)
+
+        # Une fois le PDF en cache, il est servi directement
+        self.client.force_login(User.objects.get(username="etudiant"))
+        with mock.patch("education.views.render_timetable_pdf.delay") as delay:
+            response = self.client.get(url, {"async": 1, "section": "S3"})
+        self.assertEqual(response.status_code, 200)
+        delay.assert_not_called()
+
+        failed = mock.Mock(state="FAILURE", result=RuntimeError("rendu impossible"))
+        with mock.patch("education.views.AsyncResult", return_value=failed):
+            response = self.client.get(job_url)
+            self.assertEqual(response.status_code, 500)
+            self.assertEqual(response.json()["error"], "rendu impossible")
+            # L'échec du rendu n'est pas révélé aux autres utilisateurs
+            self.client.force_login(User.objects.get(username="autre"))
+            response = self.client.get(job_url)
+            self.assertEqual(response.status_code, 403)
+            self.assertNotIn("rendu impossible", response.content.decode())
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "timetables": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+)
+class TimetableCacheTest(StudentTestCase):
+    """A cached timetable is served until one of its inputs changes."""
+
+    def setUp(self):
+        super().setUp()
+        # Le cache en mémoire est partagé avec les autres tests
+        caches["timetables"].clear()
+
+    def test_cache_follows_inputs(self):
+        self.client.force_login(User.objects.get(username="etudiant"))
+        url = "/api/student/current/timetable/"
+        with mock.patch(
+            "education.pdfcache.generate_pdf_from_courses", wraps=generate_pdf_from_courses
+        ) as render:
+            pdf = self.client.get(url).content
+            self.assertEqual(self.client.get(url).content, pdf)
+            self.assertEqual(render.call_count, 1)
+
+            SpecialDay.objects.create(name="Forum", date=datetime.date.today())
+            self.client.get(url)
+            self.assertEqual(render.call_count, 2)
+
+            Enrollment.objects.filter(student_id=self.student_id).first().delete()
+            self.client.get(url)
+            self.assertEqual(render.call_count, 3)
+
+            self.department.timetable_intro = "Nouvelle introduction"
+            self.department.save()
+            self.assertNotEqual(self.client.get(url).content, pdf)
+            self.assertEqual(render.call_count, 4)
+            self.client.get(url)
+            self.assertEqual(render.call_count, 4)
+
+
+class CalendarTest(TestCase):
+    """The academic calendar is read again as soon as its dates change."""
+
+    def test_calendar_is_invalidated(self):
+        versions = [get_calendar().version]
+        day = SpecialDay.objects.create(name="Forum", date=get_calendar().mondays[3])
+        versions.append(get_calendar().version)
+        day.date += datetime.timedelta(days=1)
+        day.save()
+        versions.append(get_calendar().version)
+        day.delete()
+        self.assertEqual(get_calendar().version, versions[0])
+
+        school_year = year_info()
+        school_year.save()
+        versions.append(get_calendar().version)
+        self.assertEqual(get_calendar().mondays[0], datetime.date(2027, 8, 30))
+        school_year.start_of_S4B = datetime.date(2028, 2, 14)
+        school_year.save()
+        versions.append(get_calendar().version)
+        school_year.delete()
+        self.assertEqual(get_calendar().version, versions[0])
+        self.assertEqual(len(set(versions)), 5)
+
+    def test_rendered_timetable_uses_new_dates(self):
+        def annual_pdf():
+            return generate_pdf_from_courses("", [], "Intro", "2A", "table", ["annual"])
+
+        before = annual_pdf()
+        SpecialDay.objects.create(name="Forum entreprises", date=get_calendar().mondays[3])
+        after = annual_pdf()
+        self.assertNotIn(b"(Forum entreprises)", pdf_content(before))
+        self.assertIn(b"(Forum entreprises)", pdf_content(after))
+
+
+class ConflictTest(SimpleTestCase):
+    """Courses conflict when they share a day string, a half-semester and a minute."""
+
+    def course(self, course_id, day, semester="S3A"):
+        return {
+            "id": course_id,
+            "day": day,
+            "semester": semester,
+            "start_time": datetime.time(8, 0),
+            "end_time": datetime.time(9, 0),
+        }
+
+    def test_unknown_days(self):
+        courses = [
+            self.course(1, "Samedi"),
+            self.course(2, "Samedi", "S3"),
+            self.course(3, "Lundi"),
+            self.course(4, "1"),
+            self.course(5, "01"),
+        ]
+        self.assertEqual(find_conflicts(courses), {(1, 2)})
+        self.assertTrue(occupancy_mask("Samedi", datetime.time(8, 0), datetime.time(9, 0), "S3A"))
+
+
+class WeeklyTableTest(SimpleTestCase):
+    """The weekly table is a copy of a shared template with the courses placed on it."""
+
+    def course(self, code, day, semester, hour):
+        return {
+            "code": code, "name": code, "day": day, "semester": semester, "ects": 2.5,
+            "start_time": datetime.time(hour, 30), "end_time": datetime.time(hour + 3, 0), "color": 0,
+        }
+
+    def test_template_is_not_modified(self):
+        template_data, template_commands = weekly_template()
+        empty = [list(row) for row in template_data]
+        courses = [self.course("FULL", "Mardi", "S3", 8), self.course("HALF", "Jeudi", "S3B", 8)]
+        table_data, commands = weekly_table(courses, "S3")
+        self.assertEqual([list(row) for row in weekly_template()[0]], empty)
+        self.assertEqual(len(weekly_template()[1]), len(template_commands))
+        self.assertGreater(len(commands), len(template_commands))
+
+        cells = {cell["code"]: cell for cell in place_weekly_courses(courses, "S3")}
+        mardi, jeudi = DAY_COLUMN["Mardi"], DAY_COLUMN["Jeudi"]
+        self.assertEqual((cells["FULL"]["column"], cells["FULL"]["last_column"]), (mardi, mardi + 1))
+        self.assertEqual((cells["HALF"]["column"], cells["HALF"]["last_column"]), (jeudi + 1, jeudi + 1))
+        self.assertEqual(table_data[cells["FULL"]["start_line"]][mardi], "FULL\n2.5 ECTS")
+        self.assertEqual(table_data[cells["HALF"]["start_line"]][jeudi + 1], "HALF\n2.5 ECTS\n(S3B)")
+        self.assertEqual(place_weekly_courses(courses, "S4"), [])
+
+
+class AnnualTableTest(SimpleTestCase):
+    """Courses are placed on the annual table without shared state."""
+
+    def course(self, code, day, hour, minute=0):
+        return {
+            "code": code,
+            "day": day,
+            "semester": "S3A",
+            "start_time": datetime.time(hour, minute),
+            "end_time": datetime.time(hour + 1, minute),
+        }
+
+    def test_sessions_of_a_course_use_their_own_slot(self):
+        calendar = AcademicCalendar()
+        cells = place_annual_courses(
+            [self.course("MATH", "Lundi", 8), self.course("MATH", "Lundi", 17)], calendar
+        )
+        row = calendar.week[calendar.semester_begin[0]]
+        self.assertEqual(cells[(row, 1)], "MATH")
+        self.assertEqual(cells[(row, 4)], "MATH")
+
+    def test_late_friday_collision(self):
+        calendar = AcademicCalendar()
+        cells = place_annual_courses(
+            [self.course("LATE", "Vendredi", 17), self.course("EARLY", "Vendredi", 16, 30)],
+            calendar,
+        )
+        row = calendar.week[calendar.semester_begin[0]]
+        self.assertEqual(cells[(row, 19)], "EARLY")
+        self.assertEqual(cells[(row, 20)], "LATE")
+
+    def test_calendar_positions(self):
+        date = datetime.date
+        calendar = AcademicCalendar(year_info())
+        self.assertEqual(calendar.locate(date(2027, 8, 30)), (1, 0))
+        # 2028 est bissextile
+        self.assertEqual(calendar.locate(date(2028, 2, 29)), (27, 1))
+        self.assertEqual(calendar.locate(date(2028, 3, 6)), (28, 0))
+        self.assertEqual(calendar.public_holiday["Armistice 1918"], date(2027, 11, 11))
+        self.assertIsNone(calendar.locate(date(2028, 6, 12)))
+        self.assertNotIn(calendar.week[date(2027, 10, 25)], calendar.teaching_weeks[1])
+        self.assertEqual(len(calendar.teaching_weeks[0]), 4)
+
+    def test_half_semester_not_starting_on_monday(self):
+        school_year = year_info()
+        school_year.start_of_S4A = datetime.date(2027, 11, 24)
+        calendar = AcademicCalendar(school_year)
+        self.assertEqual(calendar.teaching_weeks[2][0], calendar.week[datetime.date(2027, 11, 22)])
+        self.assertLess(calendar.teaching_weeks[1][-1], calendar.teaching_weeks[2][0])
+
+    def test_calendar_layers_are_shared(self):
+        special_days = [SpecialDay(name="Forum", date=datetime.date(2027, 11, 16))]
+        calendar = AcademicCalendar(year_info(), special_days)
+        layers = annual_layers(calendar)
+        # Un calendrier rechargé avec les mêmes dates réutilise les mêmes couches
+        self.assertIs(annual_layers(AcademicCalendar(year_info(), special_days)), layers)
+        self.assertIsNot(annual_layers(AcademicCalendar(year_info())), layers)
+
+        empty = [list(row) for row in layers[0]]
+        table_data, _ = annual_table([dict(self.course("C1", "Mardi", 9), name="Cours")], calendar)
+        self.assertEqual([list(row) for row in layers[0]], empty)
+        self.assertEqual(table_data[calendar.week[datetime.date(2027, 11, 15)]][5], "Forum")
+        self.assertEqual(table_data[calendar.teaching_weeks[0][0]][5], "C1")
+
+    def test_days_out_of_the_table_are_logged(self):
+        special_days = [
+            SpecialDay(name="Samedi", date=datetime.date(2027, 9, 4)),
+            SpecialDay(name="Été", date=datetime.date(2028, 7, 14)),
+        ]
+        calendar = AcademicCalendar(year_info(), special_days)
+        annual_layers.cache_clear()
+        with self.assertLogs("education.exportpdf", "DEBUG") as logs, mock.patch(
+            "sys.stdout", new_callable=io.StringIO
+        ) as stdout:
+            annual_table([], calendar)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(stdout.getvalue(), "")
+
+    def test_ics_skips_holidays(self):
+        calendar = AcademicCalendar(year_info())
+        course = dict(self.course("C1", "Jeudi", 9), name="Cours", semester="S4B")
+        dates = course_dates(course, calendar)
+        self.assertEqual(len(dates), 15)
+        self.assertNotIn(datetime.date(2028, 2, 24), dates)
+        self.assertNotIn(datetime.date(2028, 5, 25), dates)
+        ics = "".join(timetable_ics([course], calendar))
+        self.assertEqual(ics.count("BEGIN:VEVENT"), 15)
+        self.assertIn("DTSTART;TZID=Europe/Paris:20280210T090000", ics)
+
+        ics = "".join(timetable_ics([course, course], calendar))
+        uids = [line for line in ics.split("\r\n") if line.startswith("UID:")]
+        self.assertEqual(len(uids), 30)
+        self.assertEqual(len(set(uids)), 30)
+
+
+class RenderProfilingTest(SimpleTestCase):
+    """Every render logs the time spent in each of its stages."""
+
+    def test_stages_are_logged(self):
+        course = {
+            "code": "C1", "name": "Cours", "day": "Mardi", "semester": "S3A", "ects": 2,
+            "start_time": datetime.time(8, 30), "end_time": datetime.time(11, 30), "color": 0,
+        }
+        for renderer in ["table", "canvas"]:
+            with self.assertLogs("education.profiling", "DEBUG") as logs:
+                generate_pdf_from_courses("", [course], "Intro", "2A", renderer, ["S3"])
+            self.assertEqual(len(logs.records), 1)
+            timings = logs.records[0].timings
+            self.assertEqual(set(timings), set(STAGES) | {"total"})
+            self.assertGreater(timings["layout"], 0)
+            self.assertLessEqual(sum(timings[name] for name in STAGES), timings["total"])
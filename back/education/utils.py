@@ -1,336 +1,258 @@
 import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
 from io import TextIOWrapper  # Import TextIOWrapper for handling file decoding
 from datetime import datetime
 
 from django.contrib import admin
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.shortcuts import redirect, render
 from django.urls import path
 from django.urls.conf import include
-
+from django.utils.crypto import get_random_string
+
+from .academic_calendar import invalidate_calendar
+from .conflicts import add_course_conflicts
+from .csvcheck import (
+    OPENING_WEEK_DEFAULTS,
+    course_errors,
+    report,
+    special_day_errors,
+    student_errors,
+    student_username,
+)
 from .models import Course, Department, Parcours, Student, SpecialDay, YearInformation
 
 from my2a.mail import send_account_creation_mail
 
+# Nombre de mots de passe hachés entre deux appels à `progress` lors d'un
+# import d'étudiants
+IMPORT_CHUNK = 100
+
+# Processus de hachage au plus, pour ne pas accaparer la machine lors d'un upload
+MAX_HASH_WORKERS = 4
+
+# Caractères des mots de passe générés, sans ceux qui se confondent (l, I, 1, O, 0...)
+PASSWORD_CHARS = "abcdefghjkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+
 
-def importCourseCSV(csv_file):
+def importCourseCSV(csv_file, progress=None, dry_run=False):
+    """
+    Create the courses of a CSV file.
+
+    All the rows are checked at once (see csvcheck.course_errors) and the
+    courses are only created if they are all valid, with bulk_create in a
+    single transaction: either the whole file is imported or nothing is and
+    every error is reported. With `dry_run`, nothing is written.
+    `progress(done, failed, rows)` is called once the rows are checked and,
+    if they are imported, once they are written. Return (errors, created codes).
+    """
     print("--- Reading CSV file...")
     csv_file_wrapper = TextIOWrapper(
         csv_file.file, encoding="utf-8-sig"
     )  # Use TextIOWrapper for decoding
-    csv_reader = csv.DictReader(csv_file_wrapper, delimiter=";")
-
-    # Create Course objects from passed-in data
-    error_rows = []  # List to store rows with errors
-    created_rows = []  # List to store rows that were created
-    print("--- Creating courses:")
-    for row in csv_reader:
-        print(row)
-        try:
-            code = row["code"]
-            print("Ok")
-            # Check if course with the same code already exists
-            if Course.objects.filter(code=code).exists():
-                print("------ " + f"Course with code {code} already exists")
-                error_rows.append([row["code"], "Un cours avec ce code existe déjà"])
-                continue
-
-            name = row["name"]
-            department_code = row[
-                "department"
-            ]
-            ects = row["ects"]
-            description = row["description"]
-            teacher = row["teacher"]
-            day = row["day"]
-
-            # Si day est un nombre, on utilise des valeurs par défaut pour semester et les horaires
-            if day.isdigit():
-                print("------ " + f"Day {day} is a number, using default values")
-                semester = "S3"  # Valeur par défaut "S3"
-                start_time = "8:00"  # Valeur par défaut "8:00"
-                end_time = "17:00"  # Valeur par défaut "17:00"
-            else:
-                print
-                semester = row["semester"]
-                start_time = row["start_time"]
-                end_time = row["end_time"]
-
-            # catch : Field 'ects' expected a number but got 'a'.
-            try:
-                ects = float(ects)
-            except ValueError:
-                print("------ " + f"Ects {ects} is not a valid number")
-                error_rows.append(
-                    [
-                        row["code"],
-                        "Le nombre de crédits '"
-                        + ects
-                        + "' n'est pas valide. Veuillez utiliser un nombre.",
-                    ]
-                )
-                continue
-
-            # Check if department with the given code exists
-            try:
-                department = Department.objects.get(code=department_code)
-            except Department.DoesNotExist:
-                print("------ " + f"Department {department_code} does not exist")
-                error_rows.append(
-                    [
-                        row["code"],
-                        "Le département '" + department_code + "' n'existe pas",
-                    ]
-                )
-                continue
-
-            if semester not in ["S3", "S4", "S3A", "S3B", "S4A", "S4B","S5", "S5A", "S5B", "S6", "S6A", "S6B"]:
-                print("------ " + f"Semester {semester} does not exist")
-                error_rows.append(
-                    [
-                        row["code"],
-                        "Le semestre '"
-                        + semester
-                        + "' n'existe pas. Veuillez utiliser 'S3', 'S3A', 'S3B', 'S4', 'S4A' ou 'S4B'.",
-                    ]
-                )
-                continue
-            # Match semester name to semester value
-            semester_mapping = {
-                "S3": Course.Semester.S3,
-                "S3A": Course.Semester.S3A,
-                "S3B": Course.Semester.S3B,
-                "S4": Course.Semester.S4,
-                "S4A": Course.Semester.S4A,
-                "S4B": Course.Semester.S4B,
-                "S5": Course.Semester.S5,
-                "S5A": Course.Semester.S5A,
-                "S5B": Course.Semester.S5B,
-                "S6": Course.Semester.S6,
-                "S6A": Course.Semester.S6A,
-                "S6B": Course.Semester.S6B,
-            }
-            semester = semester_mapping.get(semester)
-
-            if (day not in ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"]) and not day.isdigit():
-                print("------ " + f"Day {day} does not exist")
-                error_rows.append(
-                    [
-                        row["code"],
-                        "Le jour '"
-                        + day
-                        + "' n'existe pas. Veuillez utiliser 'Lundi', 'Mardi', 'Mercredi', 'Jeudi' ou 'Vendredi'",
-                    ]
-                )
-                continue
-
-            """
-            # Match day name to day value
-            day_mapping = {
-                "Lundi": Course.Day.LUN,
-                "Mardi": Course.Day.MAR,
-                "Mercredi": Course.Day.MER,
-                "Jeudi": Course.Day.JEU,
-                "Vendredi": Course.Day.VEN,
-            }
-
-            day = day_mapping.get(day)
-            """
-
-            # # Catch “AAA” value has an invalid format. It must be in HH:MM[:ss[.uuuuuu]] format.
-            # try:
-            #     start_time = start_time.split(":")
-            #     start_time = int(start_time[0]) * 60 + int(
-            #         start_time[1]
-            #     )  # Convert start time to minutes
-            #     end_time = end_time.split(":")
-            #     end_time = int(end_time[0]) * 60 + int(
-            #         end_time[1]
-            #     )  # Convert end time to minutes
-
-            #     if start_time > end_time:
-            #         print(
-            #             "------ "
-            #             + f"Start time {start_time} is after end time {end_time}"
-            #         )
-            #         error_rows.append(
-            #             [
-            #                 row["code"],
-            #                 "L'heure de début est après l'heure de fin",
-            #             ]
-            #         )
-            #         continue
-            # except Exception as e:
-            #     print("------ ", e)
-            #     error_rows.append(
-            #         [
-            #             row["code"],
-            #             "L'horaire de début ou de fin n'est pas valide. Veuillez utiliser un format valide (HH:MM)",
-            #         ]
-            #     )
-            #     continue
-
-            course = Course(
-                name=name,
-                code=code,
-                department=department,
-                ects=ects,
-                description=description,
-                teacher=teacher,
-                semester=semester,
-                day=day,
-                start_time=start_time,
-                end_time=end_time,
+    rows = list(csv.DictReader(csv_file_wrapper, delimiter=";"))
+
+    errors = course_errors(rows)
+    if progress:
+        # Les cours ne sont traités qu'une fois écrits, sauf s'ils ne le seront pas
+        done = len(rows) if errors or dry_run else 0
+        progress(done, len({index for index, _ in errors}), len(rows))
+    if errors:
+        print(f"--- {len(errors)} error(s), no course created")
+        return report(rows, errors, lambda row: row.get("code")), []
+    if dry_run:
+        return [], [row["code"] for row in rows]
+
+    departments = {department.code: department for department in Department.objects.all()}
+    start_time_field = Course._meta.get_field("start_time")
+    end_time_field = Course._meta.get_field("end_time")
+    courses = []
+    for row in rows:
+        values = dict(row)
+        # Si day est un nombre, on utilise des valeurs par défaut pour semester et les horaires
+        if row["day"].isdigit():
+            values.update(OPENING_WEEK_DEFAULTS)
+        courses.append(
+            Course(
+                name=row["name"],
+                code=row["code"],
+                department=departments[row["department"]],
+                ects=float(row["ects"]),
+                description=row.get("description"),
+                teacher=row.get("teacher"),
+                semester=Course.Semester(values["semester"]),
+                day=row["day"],
+                # Les horaires sont convertis comme le ferait save()
+                start_time=start_time_field.to_python(values["start_time"]),
+                end_time=end_time_field.to_python(values["end_time"]),
             )
-            course.save()
-
-            created_rows.append(row["code"])  # Add row to created list
-            print("------ " + f"Course {course} created")
-
-        except Exception as e:
-            print(type(e))
-            error_rows.append([row["code"], e])  # Add row to error list
+        )
 
-    return error_rows, created_rows
+    with transaction.atomic():
+        Course.objects.bulk_create(courses, batch_size=500)
+        # bulk_create n'envoie pas post_save : les conflits des nouveaux cours
+        # sont ajoutés d'un coup
+        add_course_conflicts([course.id for course in courses])
+    if progress:
+        progress(len(rows), 0, len(rows))
+    print(f"--- {len(courses)} course(s) created")
+    return [], [course.code for course in courses]
 
 
-def importSpecialDayCSV(csv_file, replace=False):
+def importSpecialDayCSV(csv_file, replace=False, progress=None, dry_run=False):
+    """
+    Create the special days of a CSV file, replacing all the existing ones
+    with `replace`.
+
+    All the rows are checked at once (see csvcheck.special_day_errors) and
+    the valid ones are created in a single transaction. Invalid rows are
+    reported and skipped. With `dry_run`, nothing is written.
+    `progress(done, failed, rows)` is called once the rows are checked and,
+    if they are imported, once they are written. Return (errors, created names).
+    """
     print("--- Reading CSV file for Special Days...")
-    
-    # Si le flag replace est True, supprimer tous les anciens jours spéciaux
-    if replace:
-        print("--- Replace flag activé : suppression des anciens jours spéciaux")
-        SpecialDay.objects.all().delete()
-    
     csv_file_wrapper = TextIOWrapper(csv_file.file, encoding="utf-8-sig")
-    csv_reader = csv.DictReader(csv_file_wrapper, delimiter=";")
-
-    error_rows = []
-    created_rows = []
-
-    print("--- Création des jours spéciaux:")
-    for row in csv_reader:
-        print(row)
-        try:
-            name = row["name"]
-            date_str = row["date"]
-
-            # Validation du format de la date
-            try:
-                date = datetime.strptime(date_str, "%Y-%m-%d").date()
-            except ValueError:
-                print(f"------ La date {date_str} n'est pas valide")
-                error_rows.append(
-                    [name, "Mauvais format de date. Veuillez utiliser 'AAAA-MM-JJ'."]
-                )
-                continue
-
-            # Si replace n'est pas activé, on vérifie si un jour spécial identique existe déjà
-            if not replace and SpecialDay.objects.filter(name=name, date=date).exists():
-                print(f"------ Le jour spécial {name} du {date} existe déjà")
-                error_rows.append([name, f"Le jour spécial '{name}' le '{date}' existe déjà."])
-                continue
-
-            # Création et sauvegarde de l'objet SpecialDay
-            special_day = SpecialDay(name=name, date=date)
-            special_day.save()
-
-            created_rows.append(name)
-            print(f"------ Le jour spécial {special_day} a été créé")
-
-        except Exception as e:
-            print(f"------ Erreur : {e}")
-            error_rows.append([name, str(e)])
-
-    return error_rows, created_rows
+    rows = list(csv.DictReader(csv_file_wrapper, delimiter=";"))
+
+    errors = special_day_errors(rows, replace)
+    invalid = {index for index, _ in errors}
+    error_rows = report(rows, errors, lambda row: row.get("name"))
+    valid_rows = [row for index, row in enumerate(rows) if index not in invalid]
+    if progress:
+        # Seules les lignes invalides sont traitées avant l'écriture
+        progress(len(rows) if dry_run else len(invalid), len(invalid), len(rows))
+    if dry_run:
+        return error_rows, [row["name"] for row in valid_rows]
+
+    with transaction.atomic():
+        # Si le flag replace est True, supprimer tous les anciens jours spéciaux
+        if replace:
+            print("--- Replace flag activé : suppression des anciens jours spéciaux")
+            SpecialDay.objects.all().delete()
+        SpecialDay.objects.bulk_create(
+            [
+                SpecialDay(name=row["name"], date=datetime.strptime(row["date"], "%Y-%m-%d").date())
+                for row in valid_rows
+            ]
+        )
+    # bulk_create n'envoie pas post_save : le calendrier est rechargé ici
+    invalidate_calendar()
+    if progress:
+        progress(len(rows), len(invalid), len(rows))
+    print(f"--- {len(valid_rows)} special day(s) created, {len(error_rows)} error(s)")
+    return error_rows, [row["name"] for row in valid_rows]
 
 
-def importStudentCSV(csv_file):
+def hash_passwords(passwords, workers=None, progress=None):
+    """
+    Return the hashes of `passwords` (see make_password), computed by a pool
+    of at most MAX_HASH_WORKERS processes when there are enough of them: each
+    hash takes a fraction of a second of CPU. `progress(hashed)` is called
+    every IMPORT_CHUNK hashes.
+    """
+    workers = workers or min(os.cpu_count() or 1, MAX_HASH_WORKERS)
+    if workers == 1 or len(passwords) < 2 * workers:
+        return report_hashes(map(make_password, passwords), progress)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return report_hashes(
+            executor.map(make_password, passwords, chunksize=-(-len(passwords) // (4 * workers))),
+            progress,
+        )
+
+
+def report_hashes(hashes, progress):
+    result = []
+    for password in hashes:
+        result.append(password)
+        if progress and len(result) % IMPORT_CHUNK == 0:
+            progress(len(result))
+    return result
+
+
+def importStudentCSV(csv_file, workers=None, progress=None, dry_run=False):
+    """
+    Create the students of a CSV file, and their users when they don't exist.
+
+    All the rows are checked at once (see csvcheck.student_errors), the
+    passwords of the new users are hashed in parallel (see hash_passwords)
+    and the users and students of the valid rows are created with
+    bulk_create in a single transaction. Invalid rows are reported and
+    skipped. With `dry_run`, nothing is written. `progress(done, failed,
+    rows)` is called as the passwords are hashed.
+    Return (errors, created students).
+    """
     print("--- Reading CSV file...")
     csv_file_wrapper = TextIOWrapper(
         csv_file.file, encoding="utf-8-sig"
     )  # Use TextIOWrapper for decoding
-    csv_reader = csv.DictReader(csv_file_wrapper, delimiter=";")
-
-    # Create Student objects from passed-in data
-    error_rows = []  # List to store rows with errors
-    created_rows = []  # List to store rows that were created
-    print("--- Creating students:")
-    for row in csv_reader:
-        print(row)
-        try:
-            email = row["email"]
-            name = row["name"]
-            surname = row["surname"]
-            department_code = row[
-                "department"
-            ]  # Change variable name to department_code
-            year = row["year"]
-
-            # Create user
-            split = email.split("@")
-            if split[1] == "eleves.enpc.fr":
-                username = email.split("@")[0]
-            else:
-                username = email
-            password = User.objects.make_random_password()
-            user, created = User.objects.get_or_create(
-                last_name=surname,
-                first_name=name,
-                username=username,
-                email=email,
+    rows = list(csv.DictReader(csv_file_wrapper, delimiter=";"))
+
+    def label(row):
+        return (row.get("surname") or "").upper() + " " + (row.get("name") or "")
+
+    errors = student_errors(rows)
+    invalid = {index for index, _ in errors}
+    error_rows = report(rows, errors, label)
+    valid_rows = [row for index, row in enumerate(rows) if index not in invalid]
+    created_rows = [label(row) for row in valid_rows]
+    if dry_run:
+        return error_rows, created_rows
+
+    departments = {department.code: department for department in Department.objects.all()}
+    users = {
+        user.username: user
+        for user in User.objects.filter(
+            username__in={student_username(row["email"]) for row in valid_rows}
+        )
+    }
+    new_users = []
+    students = []
+    for row in valid_rows:
+        username = student_username(row["email"])
+        user = users.get(username)
+        if user is None:
+            user = User(
+                last_name=row["surname"], first_name=row["name"], username=username, email=row["email"]
             )
-
-            if created:
-                user.set_password(password)
-                user.save()
-                print("------ " + f"User {user} created")
-                # Send email
-                """if email.split("@")[1] != "eleves.enpc.fr":
-                    print("------ " + f"Sending email to {email}")
-                    send_account_creation_mail.delay(email, name, surname, password)"""
-
-            try:
-                department = Department.objects.get(code=department_code)
-            except Department.DoesNotExist:
-                print("------ " + f"Department {department_code} does not exist")
-                error_rows.append(
-                    [
-                        row["surname"].upper() + " " + row["name"],
-                        "Le département '" + department_code + "' n'existe pas",
-                    ]
-                )
-                continue
-
-            if not created and Student.objects.filter(user=user).exists():
-                print("------ " + f"Student {user} already exists")
-                error_rows.append(
-                    [
-                        row["surname"].upper() + " " + row["name"],
-                        "Un étudiant avec cet email existe déjà",
-                    ]
-                )
-                continue
-
-            Student.objects.create(
+            new_users.append(user)
+        students.append(
+            Student(
                 user=user,
-                name=name,
-                surname=surname,
-                department=department,
-                year=year,
+                name=row["name"],
+                surname=row["surname"],
+                department=departments[row["department"]],
+                year=row["year"],
                 editable=True,
             )
-
-            created_rows.append(row["surname"].upper() + " " + row["name"])
-            print("------ " + f"Student {user} created")
-
-        except Exception as e:
-            print(type(e))
-            print(e)
-            error_rows.append([row["surname"].upper() + " " + row["name"], e])
-
+        )
+
+    # Le mot de passe aléatoire n'est pas envoyé : send_account_created_mails
+    # en génère un nouveau
+    passwords = [get_random_string(10, PASSWORD_CHARS) for _ in new_users]
+    # Les lignes sans nouvel utilisateur sont traitées, les autres le sont à
+    # mesure que leur mot de passe est haché
+    waiting = len(new_users)
+    if progress:
+        progress(len(rows) - waiting, len(invalid), len(rows))
+
+    def hashed(count):
+        progress(len(rows) - waiting + count, len(invalid), len(rows))
+
+    for user, password in zip(
+        new_users, hash_passwords(passwords, workers, hashed if progress else None)
+    ):
+        user.password = password
+
+    with transaction.atomic():
+        User.objects.bulk_create(new_users, batch_size=500)
+        # bulk_create reprend la clé primaire que les utilisateurs viennent de recevoir
+        Student.objects.bulk_create(students, batch_size=500)
+    print(f"--- {len(students)} student(s) and {len(new_users)} user(s) created, {len(error_rows)} error(s)")
     return error_rows, created_rows
 
 
@@ -389,7 +311,7 @@ def send_account_created_mails():
                 # For other email domains, generate a new random password.
             # This overwrites any previous password for the user.
             # Necessary because the original plaintext password (if any) is not stored.
-            new_password = User.objects.make_random_password(length=12)  # Using a reasonable length
+            new_password = get_random_string(12, PASSWORD_CHARS)  # Using a reasonable length
             user.set_password(new_password)
             user.save()  # Save the user with the new password hash
 
@@ -1,29 +1,40 @@
 import csv
 import io
-from textwrap import wrap
 
-from django.http import FileResponse, HttpResponse, JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.template import loader
 from django.utils.decorators import method_decorator
+from django.urls import reverse
+from django.utils.http import parse_etags, quote_etag
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import auth
 from django.contrib.auth.models import User
 from django.db.models import Q
-from reportlab.lib.units import cm
-from reportlab.pdfgen import canvas
+from celery.result import AsyncResult
 from rest_framework import status
 from rest_framework.decorators import action, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, ViewSet
 import json
 
+from .academic_calendar import get_calendar
 from .admin import CourseAdmin
+from .audit import audit_students
+from .bulk import timetables_zip
+from .exportpdf import RENDERERS, SECTIONS, generate_contract_pdf
 from my2a.mail import send_confirmation_mail, send_account_status_change_mail
+from .grid import timetable_grid
+from .imports import create_import, import_status, release_lock
+from .ics import timetable_etag, timetable_ics
 from .models import Course, Department, Enrollment, Parcours, Student, Parameter, SpecialDay, YearInformation
+from .pdfcache import cached_pdf, job_owner, store_job_owner, timetable_key, timetable_pdf
+from .schedule import with_ects, with_schedules
+from .tasks import import_csv, render_contract_pdf, render_timetable_pdf
 from .serializers import (
     CompleteStudentSerializer,
     CourseSerializer,
@@ -111,9 +122,20 @@ class StudentViewset(ReadOnlyModelViewSet):
         Returns a queryset of all Student objects.
         """
 
-        queryset = Student.objects.all()
+        queryset = with_ects(Student.objects.select_related("user"))
         if "department" in self.request.GET:
             queryset = queryset.filter(department__pk=self.request.GET["department"])
+        # /api/student/?ects_under=39 (students who don't have enough ects)
+        if "ects_under" in self.request.GET:
+            try:
+                ects_under = float(self.request.GET["ects_under"])
+            except ValueError:
+                raise ValidationError({"ects_under": "A number is required"})
+            queryset = queryset.filter(total_ects__lt=ects_under)
+        # /api/student/?ordering=-ects
+        ordering = self.request.GET.get("ordering")
+        if ordering in ["ects", "-ects"]:
+            queryset = queryset.order_by(ordering.replace("ects", "total_ects"), "surname")
         return queryset
 
     @permission_classes([IsAdminUser])
@@ -121,13 +143,15 @@ class StudentViewset(ReadOnlyModelViewSet):
         """
         Returns a queryset of all Student objects.
         """
-        student = get_object_or_404(Student, id=pk)
+        student = get_object_or_404(with_ects(Student.objects.all()), id=pk)
         serializer = CompleteStudentSerializer(student)
         return Response(serializer.data)
 
     @action(detail=False, methods=["get"])
     def search(self, request):
-        students = Student.objects.filter(surname__contains=request.GET["search"])
+        students = with_ects(Student.objects.select_related("user")).filter(
+            surname__contains=request.GET["search"]
+        )
         if "department" in request.GET:
             students = students.filter(department__pk=request.GET["department"])
         serializer = StudentSerializer(students, many=True)
@@ -138,7 +162,7 @@ class StudentViewset(ReadOnlyModelViewSet):
         """
         Returns the current user.
         """
-        student = get_object_or_404(Student, user=request.user)
+        student = get_object_or_404(with_ects(Student.objects.all()), user=request.user)
         serializer = StudentSerializer(student)
         response = Response(serializer.data)
         response.set_cookie("student_id", student.id)
@@ -147,7 +171,7 @@ class StudentViewset(ReadOnlyModelViewSet):
     # Return all data of the current user (dep, parcours, courses)
     @action(detail=False, methods=["get"], url_path="current/id")
     def get_current_id(self, request):
-        student = get_object_or_404(Student, user=request.user)
+        student = get_object_or_404(with_ects(Student.objects.all()), user=request.user)
         serializer = CompleteStudentSerializer(student)
         return Response(serializer.data)
 
@@ -259,12 +283,78 @@ class StudentViewset(ReadOnlyModelViewSet):
         serializer = CourseSerializer(courses, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=["get"], permission_classes=[IsAdminUser])
+    def audit(self, request):
+        """
+        Return the students that have overlapping courses or not enough ECTS.
+        """
+        students = Student.objects.all()
+        if "department" in request.GET:
+            students = students.filter(department__pk=request.GET["department"])
+        if "editable" in request.GET:
+            students = students.filter(editable=request.GET["editable"] == "true")
+        return Response(audit_students(students))
+
     @action(detail=False, methods=["get"], url_path="current/timetable")
     def get_timetable(self, request):
         student = get_object_or_404(Student, user=request.user)
-        response = HttpResponse(content_type="application/pdf")
-        response["Content-Disposition"] = "filename=timetable.pdf"
-        response.write(student.generate_timetable())
+        courses, intro, year = student.timetable_args()
+        renderer = request.query_params.get("renderer", "table")
+        if renderer not in RENDERERS:
+            return Response(
+                {"error": f"renderer must be one of {', '.join(RENDERERS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # ?section=S3&section=annual ou ?section=S3,annual : seulement ces pages
+        sections = [
+            section
+            for value in request.query_params.getlist("section")
+            for section in value.split(",")
+            if section
+        ]
+        if not set(sections) <= set(SECTIONS):
+            return Response(
+                {"error": f"section must be among {', '.join(SECTIONS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # Le PDF ne dépend que de ces données : sa clé de cache sert d'ETag
+        key = timetable_key(courses, intro, year, renderer, sections)
+        etag = quote_etag(key.split(":")[1])
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        elif request.query_params.get("async") and cached_pdf(key) is None:
+            # Le rendu est confié à Celery, le client suit l'avancement sur pdf-jobs
+            job = render_timetable_pdf.delay(student.id, request.user.id, renderer, sections)
+            return pdf_job_response(job, request.user)
+        else:
+            response = HttpResponse(content_type="application/pdf")
+            response["Content-Disposition"] = "filename=timetable.pdf"
+            response.write(timetable_pdf(courses, intro, year, renderer, sections))
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    @action(detail=False, methods=["get"], url_path="current/timetable/grid")
+    def get_timetable_grid(self, request):
+        student = get_object_or_404(Student, user=request.user)
+        courses, _, year = student.timetable_args()
+        return Response(timetable_grid(courses, year))
+
+    @action(detail=False, methods=["get"], url_path="current/timetable.ics")
+    def get_timetable_ics(self, request):
+        student = get_object_or_404(Student, user=request.user)
+        courses = student.timetable_courses()
+        calendar = get_calendar()
+        etag = quote_etag(timetable_etag(courses, calendar))
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = StreamingHttpResponse(
+                timetable_ics(courses, calendar), content_type="text/calendar; charset=utf-8"
+            )
+            response["Content-Disposition"] = 'attachment; filename="timetable.ics"'
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
         return response
 
     @action(detail=False, methods=["post"], url_path="updatestatus")
@@ -444,17 +534,66 @@ class PostEnrollment(APIView):
             enrollment.save()
 
 
+def start_import_job(kind, csv_file, **options):
+    """
+    Hand a CSV file over to the import_csv task and answer 202 with the job
+    to follow, or 409 if an import of the same kind is running.
+    """
+    job_id = create_import(kind, csv_file.read())
+    if job_id is None:
+        return Response(
+            {"success": False, "error": "Un import de ce type est déjà en cours"},
+            status=status.HTTP_409_CONFLICT,
+        )
+    try:
+        import_csv.delay(job_id, kind, options)
+    except Exception:
+        release_lock(kind, job_id)
+        raise
+    url = reverse("import_job", args=[job_id])
+    response = Response({"success": True, "job": job_id, "url": url}, status=status.HTTP_202_ACCEPTED)
+    response["Location"] = url
+    return response
+
+
+def dry_run_response(failed, created):
+    """
+    Answer a ?dry_run=1 import: every error of the file, nothing written. The
+    file is checked synchronously, even with ?async=1.
+    """
+    return Response(
+        {"success": True, "dry_run": True, "failed": failed, "created": created},
+        status=status.HTTP_200_OK,
+    )
+
+
+class ImportJobView(APIView):
+    """Progress of a CSV import started with ?async=1, then its result."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, job_id):
+        state = import_status(job_id)
+        if state is None:
+            return Response({"error": "unknown job"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(state)
+
+
 class ImportCourseCSV(APIView):
     def post(self, request):
         try:
             csv_file = request.FILES.get("csv_file")
             if csv_file:
+                if request.query_params.get("dry_run"):
+                    return dry_run_response(*importCourseCSV(csv_file, dry_run=True))
+                if request.query_params.get("async"):
+                    return start_import_job("course", csv_file)
                 failed, created = importCourseCSV(csv_file)
                 if failed:
                     return Response(
                         {
                             "success": True,
-                            "error": "Some rows failed to import",
+                            "error": "Some rows are invalid, no course was imported",
                             "failed": failed,
                             "created": created,
                         },
@@ -490,6 +629,12 @@ class ImportSpecialDayCSV(APIView):
             replace_flag = request.POST.get("replace", "false").lower() == "true"
 
             if csv_file:
+                if request.query_params.get("dry_run"):
+                    return dry_run_response(
+                        *importSpecialDayCSV(csv_file, replace=replace_flag, dry_run=True)
+                    )
+                if request.query_params.get("async"):
+                    return start_import_job("specialday", csv_file, replace=replace_flag)
                 # Transmet le flag à la fonction d'import pour réaliser le remplacement
                 failed, created = importSpecialDayCSV(csv_file, replace=replace_flag)
                 if failed:
@@ -528,6 +673,10 @@ class ImportStudentCSV(APIView):
         try:
             csv_file = request.FILES.get("csv_file")
             if csv_file:
+                if request.query_params.get("dry_run"):
+                    return dry_run_response(*importStudentCSV(csv_file, dry_run=True))
+                if request.query_params.get("async"):
+                    return start_import_job("student", csv_file)
                 failed, created = importStudentCSV(csv_file)
                 if failed:
                     return Response(
@@ -567,118 +716,134 @@ class ViewContractPDF(APIView):
         if not user.is_superuser:
             return Response({"status": "error", "message": "not authorized"})
         student = get_object_or_404(Student, id=id)
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer)
-        textobject = p.beginText(2 * cm, 29.7 * cm - 2 * cm)
-        textobject.textLine(
-            "Contrat de formation de " + student.name + " " + student.surname
-        )
-        textobject.textLine(" ")
-        textobject.textLine("Département: " + student.department.code)
-        textobject.textLine("Parcours: " + student.parcours.name)
-        textobject.textLine("Nombres d'ECTS: " + str(student.count_ects()))
-        textobject.textLine(" ")
-        if student.parcours is not None:
-            textobject.textLine("Liste des cours:")
-            textobject.textLine(" ")
-            textobject.textLine("Obligatoire parcours:")
-            for course in student.parcours.courses_mandatory.all():
-                wraped_text = "\n".join(
-                    wrap(
-                        course.name
-                        + " - "
-                        + course.semester
-                        + " - "
-                        + str(course.ects)
-                        + " ECTS",
-                        80,
-                    )
-                )
-                textobject.textLines(wraped_text)
-
-            textobject.textLine(" ")
-            textobject.textLine("Obligatoire sur liste:")
-            for enrollment in student.mandatory_courses():
-                wraped_text = "\n".join(
-                    wrap(
-                        enrollment.course.name
-                        + " - "
-                        + enrollment.course.semester
-                        + " - "
-                        + str(enrollment.course.ects)
-                        + " ECTS",
-                        80,
-                    )
-                )
-                textobject.textLine(wraped_text)
-            textobject.textLine(" ")
-            textobject.textLine("Cours électifs: ")
-            for enrollment in student.elective_courses():
-                wraped_text = "\n".join(
-                    wrap(
-                        enrollment.course.name
-                        + " - "
-                        + enrollment.course.semester
-                        + " - "
-                        + str(enrollment.course.ects)
-                        + " ECTS",
-                        80,
-                    )
-                )
-                textobject.textLines(wraped_text)
-        else:
-            textobject.textLine("Pas de parcours sélectionné par l'étudiant")
-        textobject.textLine(" ")
-        p.drawText(textobject)
-        p.showPage()
-        p.save()
-        buffer.seek(0)
+        if request.query_params.get("async"):
+            return pdf_job_response(render_contract_pdf.delay(student.id, user.id), user)
         return FileResponse(
-            buffer, filename="contrat" + student.name + "_" + student.surname + ".pdf"
+            io.BytesIO(generate_contract_pdf(student)),
+            filename="contrat" + student.name + "_" + student.surname + ".pdf",
         )
 
 
+def pdf_job_response(job, user):
+    """Answer 202 with the id of a PDF rendering job and where to follow it."""
+    store_job_owner(job.id, user.id)
+    url = reverse("pdf_job", args=[job.id])
+    response = Response({"job": job.id, "url": url}, status=status.HTTP_202_ACCEPTED)
+    response["Location"] = url
+    return response
+
+
+class PDFJobView(APIView):
+    """
+    Status of a PDF rendered by Celery (see education.tasks): the PDF itself
+    once it is ready, its state otherwise.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = AsyncResult(job_id)
+        # Un rendu n'est suivi que par celui qui l'a lancé, y compris son échec :
+        # le message d'erreur n'est donné que si l'on sait à qui il appartient
+        owner = job_owner(job_id)
+        if owner not in (None, request.user.id) or (job.state == "FAILURE" and owner is None):
+            return Response({"error": "not authorized"}, status=status.HTTP_403_FORBIDDEN)
+        if job.state == "FAILURE":
+            return Response(
+                {"job": job_id, "status": "failed", "error": str(job.result)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+        if job.state != "SUCCESS":
+            # PENDING, STARTED ou RETRY ; un identifiant inconnu est aussi PENDING
+            return Response({"job": job_id, "status": "pending"})
+        result = job.result
+        if result["user"] != request.user.id:
+            return Response({"error": "not authorized"}, status=status.HTTP_403_FORBIDDEN)
+        pdf = cached_pdf(result["key"])
+        if pdf is None:
+            return Response({"job": job_id, "status": "expired"}, status=status.HTTP_410_GONE)
+        response = HttpResponse(pdf, content_type="application/pdf")
+        response["Content-Disposition"] = f'filename="{result["filename"]}"'
+        return response
+
+
+class Echo:
+    """
+    File-like object whose write returns the value instead of storing it, so
+    that csv.writer can produce rows for a StreamingHttpResponse.
+    """
+
+    def write(self, value):
+        return value
+
+
 class ExportStudentsView(APIView):
 
     permission_classes = [IsAdminUser]
 
     def get(self, request):
-        response = HttpResponse(
-            content_type="text/csv",
-            headers={"Content-Disposition": 'attachment; filename="etudiants.csv"'},
-        )
-        response.write("\ufeff".encode("utf8"))
-        writer = csv.writer(response, delimiter=";")
-        writer.writerow(
-            [
-                "Prénom",
-                "Nom",
-                "Département",
-                "Parcours",
-                "Cours obligatoires sur liste",
-                "Cours électifs",
-                "Total ECTS",
-                "Commentaire",
-            ]
-        )
-        students = Student.objects.all().filter(editable=False)
+        students = with_schedules(with_ects(Student.objects.filter(editable=False)))
         if "dep" in request.GET:
             students = students.filter(department__pk=request.GET["dep"])
-            print(students)
-        for student in students:
-            writer.writerow(
+        writer = csv.writer(Echo(), delimiter=";")
+
+        def rows():
+            yield "\ufeff"
+            yield writer.writerow(
                 [
-                    student.name,
-                    student.surname,
-                    student.department,
-                    student.parcours,
-                    course_list_to_string(student.mandatory_courses()),
-                    course_list_to_string(student.elective_courses()),
-                    student.count_ects(),
-                    student.comment,
+                    "Prénom",
+                    "Nom",
+                    "Département",
+                    "Parcours",
+                    "Cours obligatoires sur liste",
+                    "Cours électifs",
+                    "Total ECTS",
+                    "Commentaire",
                 ]
             )
-        return response
+            for student in students.iterator(chunk_size=500):
+                schedule = student.schedule()
+                yield writer.writerow(
+                    [
+                        student.name,
+                        student.surname,
+                        student.department,
+                        student.parcours,
+                        course_list_to_string(schedule.mandatory),
+                        course_list_to_string(schedule.elective),
+                        student.total_ects,
+                        student.comment,
+                    ]
+                )
+
+        return StreamingHttpResponse(
+            rows(),
+            content_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="etudiants.csv"'},
+        )
+
+
+class ExportTimetablesView(APIView):
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # /api/students/timetables?dep=1&parcours=2
+        if "dep" not in request.GET:
+            return Response(
+                {"error": "dep parameter is required"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        department = get_object_or_404(Department, pk=request.GET["dep"])
+        students = Student.objects.filter(department=department)
+        if "parcours" in request.GET:
+            students = students.filter(parcours__pk=request.GET["parcours"])
+        return StreamingHttpResponse(
+            timetables_zip(students),
+            content_type="application/zip",
+            headers={
+                "Content-Disposition": f'attachment; filename="edt_{department.code}.zip"'
+            },
+        )
 
 
 class ParcoursViewset(ViewSet):
@@ -748,6 +913,59 @@ class ParcoursViewset(ViewSet):
         serializer = CourseSerializer(courses, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=["get"], permission_classes=[IsAdminUser])
+    def conflicts(self, request):
+        """
+        Return, for each parcours, the pairs of courses that overlap among its
+        mandatory courses, among its courses on list, and between the two.
+        """
+        parcours_list = Parcours.objects.prefetch_related(
+            "courses_mandatory", "courses_on_list"
+        ).order_by("name")
+        if "department" in request.GET:
+            parcours_list = parcours_list.filter(department__pk=request.GET["department"])
+        if "parcours" in request.GET:
+            parcours_list = parcours_list.filter(pk=request.GET["parcours"])
+        parcours_list = list(parcours_list)
+
+        course_ids = {
+            course.id
+            for parcours in parcours_list
+            for course in [*parcours.courses_mandatory.all(), *parcours.courses_on_list.all()]
+        }
+        edges = set(
+            Course.conflicts.through.objects.filter(
+                from_course_id__in=course_ids, to_course_id__in=course_ids
+            ).values_list("from_course_id", "to_course_id")
+        )
+
+        def conflicting_pairs(first, second):
+            # Dans une même liste, chaque paire n'est rapportée qu'une fois
+            return [
+                [
+                    {"id": a.id, "code": a.code, "name": a.name},
+                    {"id": b.id, "code": b.code, "name": b.name},
+                ]
+                for a in first
+                for b in second
+                if (a.id, b.id) in edges and (first is not second or a.id < b.id)
+            ]
+
+        response = []
+        for parcours in parcours_list:
+            mandatory = list(parcours.courses_mandatory.all())
+            on_list = list(parcours.courses_on_list.all())
+            response.append(
+                {
+                    "id": parcours.id,
+                    "name": parcours.name,
+                    "mandatory": conflicting_pairs(mandatory, mandatory),
+                    "on_list": conflicting_pairs(on_list, on_list),
+                    "mandatory_on_list": conflicting_pairs(mandatory, on_list),
+                }
+            )
+        return Response(response)
+
     @action(detail=False, methods=["get"], permission_classes=[IsAdminUser])
     def avalaible_mandatory(self, request):
         if "department" not in request.GET:
@@ -9,16 +9,11 @@ def get_department_admins(department):
 
 @shared_task(name="send_confirmation_mail")
 def send_confirmation_mail(studentId):
-    student = Student.objects.get(id=studentId) 
-    mandatory_count = 0
-    elective_count = 0
-    parcours_count = 0
-    for course in student.mandatory_courses():
-        mandatory_count += course.course.ects
-    for course in student.elective_courses():
-        elective_count += course.course.ects
-    for course in student.parcours.courses_mandatory.all():
-        parcours_count += course.ects
+    student = Student.objects.select_related("user", "department", "parcours").get(id=studentId)
+    schedule = student.schedule()
+    mandatory_count = sum(enrollment.course.ects for enrollment in schedule.mandatory)
+    elective_count = sum(enrollment.course.ects for enrollment in schedule.elective)
+    parcours_count = sum(course.ects for course in schedule.parcours_courses)
 
     send_templated_mail(
         template_name="confirmation",
@@ -27,9 +22,9 @@ def send_confirmation_mail(studentId):
         context={
             "student": student,
             "parcours_name": student.parcours.name,
-            "mandatory_courses": student.parcours.courses_mandatory.all(),
-            "onlist_courses": student.mandatory_courses(),
-            "elective_courses": student.elective_courses(),
+            "mandatory_courses": schedule.parcours_courses,
+            "onlist_courses": schedule.mandatory,
+            "elective_courses": schedule.elective,
             "mandatory_count": mandatory_count,
             "elective_count": elective_count,
             "parcours_count": parcours_count,
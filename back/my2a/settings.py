@@ -184,3 +184,26 @@ CELERY_RESULT_BACKEND = f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:6379/0"
 CELERY_ACCEPT_CONTENT = ["application/json"]
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TASK_SERIALIZER = "json"
+
+# Cache settings
+# Generated timetables are cached in Redis (database 1, the broker uses 0)
+# and evicted a week after being rendered
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "timetables": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:6379/1",
+        "TIMEOUT": 60 * 60 * 24 * 7,
+        "KEY_PREFIX": "my2a",
+    },
+    # Fichiers CSV en attente d'import, état des imports et verrous (voir
+    # education.imports), partagés entre l'API et les workers Celery
+    "imports": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:6379/1",
+        "TIMEOUT": 60 * 60 * 24,
+        "KEY_PREFIX": "my2a-imports",
+    },
+}